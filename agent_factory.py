@@ -5,7 +5,7 @@ from custom_agent import CustomAnthropicAgent
 from agent_squad.agents import AnthropicAgentOptions
 from agent_squad.utils import AgentTool, AgentTools
 import local_tools as local_tools
-from custom_agent import mcp_tool_func, tool_surrogate_func
+from custom_agent import mcp_tool_func, tool_surrogate_func, MAX_PARALLEL_TOOL_CALLS
 from main_prompt_builder import build_main_prompt
 import inspect
 
@@ -18,12 +18,13 @@ LOCALLY_IMPLEMENTED_TOOLS = {name: func for name, func in inspect.getmembers(loc
 
 
 
-def create_agents_from_scenario(file_path: str):
+def create_agents_from_scenario(file_path: str, streaming: bool = False):
     """
     Reads a scenario configuration file and creates a list of Anthropic agents.
 
     Args:
         file_path: The path to the scenario JSON file.
+        streaming: Whether the agents stream their responses token by token.
 
     Returns:
         A list of configured AnthropicAgent instances.
@@ -76,13 +77,15 @@ def create_agents_from_scenario(file_path: str):
             description=agent_config.get('situation'),
             api_key=ANTHROPIC_API_KEY,
             model_id = 'claude-haiku-4-5-20251001',
-            streaming=False,
+            streaming=streaming,
             custom_system_prompt={"template": system_prompt},
-            tool_config = {'tool': tools, 'toolMaxRecursions': 10}
+            tool_config = {'tool': tools, 'toolMaxRecursions': 10, 'toolMaxParallelCalls': MAX_PARALLEL_TOOL_CALLS}
         ))
         print(f"**SYSTEM PROMPT FOR AGENT {agent_config.get('agentId')}**\n{system_prompt}\n*******")
         # Save the entire configuration dictionary
         agent.agent_config = agent_config
+        # Render the static parts of the tool surrogate prompts once per run
+        agent.compile_prompts(scenario_data)
         agents.append(agent)
 
     return scenario_data, agents
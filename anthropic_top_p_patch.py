@@ -9,16 +9,20 @@ Usage:
     import anthropic_top_p_patch
     # Now use anthropic client normally
 
-The patch works by wrapping the Messages.create() method to strip out
-the top_p parameter before calling the original method.
+The patch works by wrapping the Messages.create() and Messages.stream()
+methods (sync and async) to strip out the top_p parameter before calling
+the original method. Streaming requests do not go through create(), so
+both have to be wrapped.
 """
 
 import anthropic
 from functools import wraps
 
-# Store the original create methods
+# Store the original create and stream methods
 _original_sync_create = anthropic.resources.messages.Messages.create
 _original_async_create = anthropic.resources.messages.AsyncMessages.create
+_original_sync_stream = anthropic.resources.messages.Messages.stream
+_original_async_stream = anthropic.resources.messages.AsyncMessages.stream
 
 def _create_wrapper(original_func):
     """Wrapper that removes top_p from kwargs before calling the original function."""
@@ -35,6 +39,7 @@ def _create_wrapper(original_func):
         return await original_func(self, *args, **kwargs)
     
     # Return appropriate wrapper based on whether function is async
+    # (AsyncMessages.stream is a plain method returning an async context manager)
     import inspect
     if inspect.iscoroutinefunction(original_func):
         return async_wrapper
@@ -44,5 +49,7 @@ def _create_wrapper(original_func):
 # Apply the patches
 anthropic.resources.messages.Messages.create = _create_wrapper(_original_sync_create)
 anthropic.resources.messages.AsyncMessages.create = _create_wrapper(_original_async_create)
+anthropic.resources.messages.Messages.stream = _create_wrapper(_original_sync_stream)
+anthropic.resources.messages.AsyncMessages.stream = _create_wrapper(_original_async_stream)
 
 print("✓ Anthropic SDK patched: top_p parameter will be automatically removed from all API requests")
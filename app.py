@@ -1,27 +1,279 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request
+from werkzeug.serving import make_server
+from bisect import bisect_right
+from collections import deque
+import asyncio
+import json
 import threading
+import time
+import uuid
 import signal
 import os
-from tts_service import tts_service
+
+DEFAULT_RUN_ID = "default"  # Run used by the command line, and by the UI when no run_id is given
+
+SERVER_INSTANCE = uuid.uuid4().hex[:8]  # Part of every history ETag, so they never match across restarts
 
 app = Flask(__name__)
-chat_history = []
-chat_history_lock = threading.Lock()  # Lock for thread-safe access to chat_history
-scenario_info = {}
+chat_histories = {}  # run_id -> ChatHistory
+chat_history_lock = threading.Lock()  # Lock for thread-safe access to chat_histories
+scenario_infos = {}  # run_id -> scenario title/description
+streaming_messages = {}  # run_id -> message currently being streamed by an agent
 audio_playback_complete = threading.Event()
 audio_playback_complete.set()  # Initially ready
 flask_thread = None
-is_paused = False  # Global pause state
+flask_server = None
+flask_thread_lock = threading.Lock()
+
+EVENT_BUFFER_SIZE = 500     # Recent events kept per run so a reconnecting page can catch up
+EVENT_KEEPALIVE_SECONDS = 15
+STREAMING_UPDATE_INTERVAL = 0.1  # Seconds between streaming text updates sent to one page (at most ~10/s)
+RUN_RETENTION_SECONDS = 600  # How long a finished run's chat stays available before it is dropped
+
+
+class RunEventChannel:
+    """
+    Numbered stream of UI events for one run (new messages, message updates,
+    scenario info, pause state). /events subscribers wait on the condition and
+    are sent every event after the last sequence number they saw.
+
+    The partial text of the message being streamed is not an event: it is
+    re-sent in full on every token, so only the latest one is kept (with a
+    version number). Buffering it would push the real events out of the replay
+    buffer, and sending every version would grow quadratically with the reply.
+    """
+
+    def __init__(self):
+        self.seq = 0
+        self.events = deque(maxlen=EVENT_BUFFER_SIZE)  # (seq, event_type, data)
+        self.streaming = None        # Latest partial message, or None
+        self.streaming_version = 0   # Incremented on every streaming update
+        self.condition = threading.Condition()
+        self.subscribers = 0  # Open /events streams
+
+    def publish(self, event_type, data):
+        with self.condition:
+            self.seq += 1
+            self.events.append((self.seq, event_type, data))
+            self.condition.notify_all()
+
+    def publish_streaming(self, message):
+        """Replace the partial message being streamed (None when the turn is done)."""
+        with self.condition:
+            self.streaming = message
+            self.streaming_version += 1
+            self.condition.notify_all()
+
+    def events_after(self, last_seq, streaming_version, timeout, streaming_delay=0.0):
+        """
+        Blocks until there are events after last_seq, or the streaming message
+        is newer than streaming_version and streaming_delay seconds have passed
+        (or the timeout passes). Returns (events, current_seq, streaming), where
+        events is None if the subscriber fell behind the buffer and needs a
+        fresh snapshot, and streaming is (version, message) if it changed.
+        """
+        now = time.monotonic()
+        deadline = now + timeout
+        streaming_ready = now + streaming_delay
+        with self.condition:
+            while self.seq <= last_seq and now < deadline:
+                streaming_changed = self.streaming_version != streaming_version
+                if streaming_changed and now >= streaming_ready:
+                    break
+                self.condition.wait((min(deadline, streaming_ready) if streaming_changed else deadline) - now)
+                now = time.monotonic()
+            streaming = None
+            if self.streaming_version != streaming_version:
+                streaming = (self.streaming_version, self.streaming)
+            if self.events and self.events[0][0] > last_seq + 1:
+                return None, self.seq, streaming
+            return [event for event in self.events if event[0] > last_seq], self.seq, streaming
+
+
+class PauseGate:
+    """
+    Pause state of one run. The turn loop awaits wait_resumed() instead of
+    polling; /pause_state runs on a Flask thread and wakes the waiters on
+    their own event loops, so nothing blocks while a run is paused.
+    """
+
+    def __init__(self):
+        self.paused = False
+        self._waiters = set()  # (event loop, asyncio.Event) of each waiting coroutine
+        self._lock = threading.Lock()
+
+    def set_paused(self, paused):
+        with self._lock:
+            self.paused = paused
+            waiters = [] if paused else list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # The loop has been closed
+
+    async def wait_resumed(self):
+        """Returns as soon as the run is not paused."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            if not self.paused:
+                return
+            self._waiters.add(waiter)
+        try:
+            await waiter[1].wait()
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+
+pause_gates = {}  # run_id -> PauseGate
+pause_gates_lock = threading.Lock()
+
+def get_pause_gate(run_id):
+    with pause_gates_lock:
+        gate = pause_gates.get(run_id)
+        if gate is None:
+            gate = pause_gates[run_id] = PauseGate()
+        return gate
+
+
+run_channels = {}  # run_id -> RunEventChannel
+run_channels_lock = threading.Lock()
+
+def get_run_channel(run_id):
+    with run_channels_lock:
+        channel = run_channels.get(run_id)
+        if channel is None:
+            channel = run_channels[run_id] = RunEventChannel()
+        return channel
+
+active_runs = set()    # Runs started with begin_run() that have not finished
+finished_runs = {}     # run_id -> time.time() when the run finished
+run_lifecycle_lock = threading.Lock()
+
+def begin_run(run_id):
+    """Mark a run as started, so its UI state is kept until finish_run()."""
+    with run_lifecycle_lock:
+        active_runs.add(run_id)
+        finished_runs.pop(run_id, None)
+    sweep_finished_runs()
+
+def finish_run(run_id):
+    """Mark a run as finished; its UI state is dropped RUN_RETENTION_SECONDS later."""
+    with run_lifecycle_lock:
+        active_runs.discard(run_id)
+        finished_runs[run_id] = time.time()
+    sweep_finished_runs()
+
+def sweep_finished_runs():
+    """
+    Drops the chat history, event channel, pause gate, scenario info and
+    streaming text of runs that finished more than RUN_RETENTION_SECONDS ago,
+    or that were never started (e.g. a page opened with a stale run_id), once
+    no page is subscribed to their events. The default (command line) run is
+    always kept.
+    """
+    now = time.time()
+    with run_lifecycle_lock, chat_history_lock, run_channels_lock, pause_gates_lock:
+        known = set(chat_histories) | set(run_channels) | set(pause_gates) | set(scenario_infos)
+        for run_id in known:
+            if run_id == DEFAULT_RUN_ID or run_id in active_runs:
+                continue
+            if now - finished_runs.get(run_id, 0) < RUN_RETENTION_SECONDS:
+                continue
+            channel = run_channels.get(run_id)
+            if channel is not None and channel.subscribers:
+                continue
+            for table in (chat_histories, run_channels, pause_gates, scenario_infos, streaming_messages, finished_runs):
+                table.pop(run_id, None)
+
 
-def update_chat_history(new_history):
-    global chat_history
-    # Audio is now generated in main.py before this is called
+class ChatHistory:
+    """
+    UI messages of one run. Messages are only ever appended or updated in
+    place, and every change gets a sequence number, so a client can ask for
+    just the messages that changed after the last sequence number it saw.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.seq = 0
+        self.change_seqs = []     # Sequence number of every change, ascending
+        self.change_indexes = []  # Index of the message changed at that sequence number
+
+    def _record_change(self, index):
+        self.seq += 1
+        self.change_seqs.append(self.seq)
+        self.change_indexes.append(index)
+
+    def append(self, message):
+        self.messages.append(message)
+        self._record_change(len(self.messages) - 1)
+        return len(self.messages) - 1
+
+    def update(self, index, message):
+        self.messages[index] = message
+        self._record_change(index)
+
+    def changes_since(self, since):
+        """[{"index": i, "message": m}] for every message changed after `since`, in index order."""
+        start = bisect_right(self.change_seqs, since)
+        indexes = sorted(set(self.change_indexes[start:]))
+        return [{"index": index, "message": self.messages[index]} for index in indexes]
+
+
+def _get_chat_history(run_id):
+    """The run's ChatHistory; callers hold chat_history_lock."""
+    history = chat_histories.get(run_id)
+    if history is None:
+        history = chat_histories[run_id] = ChatHistory()
+    return history
+
+def append_chat_message(message, run_id=DEFAULT_RUN_ID):
+    """Add a message to the end of the run's chat. Returns its index."""
+    message = dict(message)  # Later changes by the caller must go through update_chat_message
+    with chat_history_lock:
+        index = _get_chat_history(run_id).append(message)
+    get_run_channel(run_id).publish("message", {"index": index, "message": message})
+    return index
+
+def update_chat_message(index, message, run_id=DEFAULT_RUN_ID):
+    """Replace a message that was already published (e.g. to attach its audio_url)."""
+    message = dict(message)
     with chat_history_lock:
-        chat_history = new_history
+        _get_chat_history(run_id).update(index, message)
+    get_run_channel(run_id).publish("message_update", {"index": index, "message": message})
 
-def update_scenario_info(new_info):
-    global scenario_info
-    scenario_info = new_info
+def update_chat_history(new_history, run_id=DEFAULT_RUN_ID):
+    """Bring the run's chat in line with a full message list, publishing only the differences."""
+    with chat_history_lock:
+        old_messages = list(_get_chat_history(run_id).messages)
+    for index, message in enumerate(new_history):
+        if index >= len(old_messages):
+            append_chat_message(message, run_id)
+        elif old_messages[index] != message:
+            update_chat_message(index, message, run_id)
+
+def update_streaming_message(message, run_id=DEFAULT_RUN_ID):
+    """
+    Publish the partial text of the message being generated (None when the turn
+    is done). Only the latest version is kept; pages are sent it at most every
+    STREAMING_UPDATE_INTERVAL seconds.
+    """
+    with chat_history_lock:
+        if message is None:
+            streaming_messages.pop(run_id, None)
+        else:
+            streaming_messages[run_id] = message
+    get_run_channel(run_id).publish_streaming(message)
+
+def update_scenario_info(new_info, run_id=DEFAULT_RUN_ID):
+    scenario_infos[run_id] = new_info
+    get_run_channel(run_id).publish("info", new_info)
+
+def _request_run_id():
+    """The run a UI request refers to (passed as ?run_id=... by the chat page)."""
+    return request.args.get('run_id') or DEFAULT_RUN_ID
 
 @app.route('/')
 def index():
@@ -29,14 +281,108 @@ def index():
 
 @app.route('/history')
 def history():
+    """
+    The run's chat messages. With ?since=<seq> only the messages changed after
+    that sequence number are returned, as {"seq": ..., "messages": [{"index", "message"}]}.
+    Responses carry an ETag, and a matching If-None-Match gets a 304. The tag
+    names the representation (full list, or delta from which cursor) as well as
+    the version, so one is never revalidated against the other.
+    """
+    run_id = _request_run_id()
+    since = request.args.get('since', type=int)
+    with chat_history_lock:
+        chat_history = _get_chat_history(run_id)
+        seq = chat_history.seq
+        if since is None:
+            etag = f"{SERVER_INSTANCE}-{run_id}-full-{seq}"
+        else:
+            # Every cursor at or past seq gets the same (empty) delta
+            etag = f"{SERVER_INSTANCE}-{run_id}-since{min(since, seq)}-{seq}"
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={'ETag': f'"{etag}"'})
+        # Copy under the lock, serialize outside it
+        if since is None:
+            body = list(chat_history.messages)
+        else:
+            body = {"seq": seq, "messages": chat_history.changes_since(since)}
+    response = jsonify(body)
+    response.set_etag(etag)
+    return response
+
+@app.route('/streaming')
+def streaming():
+    with chat_history_lock:
+        message = streaming_messages.get(_request_run_id())
+    return jsonify(message)
+
+def _format_event(seq, event_type, data):
+    """An SSE event; without a seq it has no id, so it does not move the page's Last-Event-ID."""
+    event_id = f"id: {seq}\n" if seq is not None else ""
+    return f"{event_id}event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+def _run_snapshot(run_id):
+    """Everything the chat page needs to render a run from scratch."""
     with chat_history_lock:
-        # Create a copy to avoid holding the lock during JSON serialization
-        history_copy = list(chat_history)
-    return jsonify(history_copy)
+        return {
+            "history": list(_get_chat_history(run_id).messages),
+            "streaming": streaming_messages.get(run_id),
+            "info": scenario_infos.get(run_id, {}),
+            "paused": is_execution_paused(run_id),
+        }
+
+@app.route('/events')
+def events():
+    """
+    Server-Sent Events stream for one run. Starts with a "snapshot" event (or
+    resumes after Last-Event-ID on reconnect) and then pushes each change as it
+    happens, so the page no longer has to poll. Streaming text is sent as
+    unnumbered "streaming" events, at most every STREAMING_UPDATE_INTERVAL
+    seconds and always with the latest text.
+    """
+    run_id = _request_run_id()
+    channel = get_run_channel(run_id)
+    last_event_id = request.headers.get('Last-Event-ID', '')
+
+    def generate():
+        with channel.condition:
+            channel.subscribers += 1
+        try:
+            last_seq = int(last_event_id) if last_event_id.isdigit() else None
+            streaming_version = -1  # On resume, send the current streaming text right away
+            if last_seq is None or last_seq > channel.seq:
+                last_seq = channel.seq
+                streaming_version = channel.streaming_version  # Read first: a later update is sent again
+                yield _format_event(last_seq, "snapshot", _run_snapshot(run_id))
+            streaming_sent_at = 0.0
+            while True:
+                streaming_delay = max(0.0, streaming_sent_at + STREAMING_UPDATE_INTERVAL - time.monotonic())
+                new_events, current_seq, streaming = channel.events_after(
+                    last_seq, streaming_version, EVENT_KEEPALIVE_SECONDS, streaming_delay)
+                if new_events is None:
+                    streaming_version = channel.streaming_version
+                    last_seq = current_seq
+                    yield _format_event(last_seq, "snapshot", _run_snapshot(run_id))
+                    continue
+                for seq, event_type, data in new_events:
+                    yield _format_event(seq, event_type, data)
+                if new_events:
+                    last_seq = new_events[-1][0]
+                if streaming is not None:
+                    streaming_version, message = streaming
+                    streaming_sent_at = time.monotonic()
+                    yield _format_event(None, "streaming", message)
+                if not new_events and streaming is None:
+                    yield ": keepalive\n\n"
+        finally:
+            with channel.condition:
+                channel.subscribers -= 1
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/info')
 def info():
-    return jsonify(scenario_info)
+    return jsonify(scenario_infos.get(_request_run_id(), {}))
 
 @app.route('/audio_complete', methods=['POST'])
 def audio_complete():
@@ -48,18 +394,20 @@ def audio_complete():
 @app.route('/pause_state', methods=['GET', 'POST'])
 def pause_state():
     """Get or set the pause state"""
-    global is_paused
+    run_id = _request_run_id()
     if request.method == 'POST':
         data = request.get_json()
-        is_paused = data.get('paused', False)
-        return jsonify({"paused": is_paused})
-    else:
-        return jsonify({"paused": is_paused})
+        get_pause_gate(run_id).set_paused(bool(data.get('paused', False)))
+        get_run_channel(run_id).publish("pause", {"paused": is_execution_paused(run_id)})
+    return jsonify({"paused": is_execution_paused(run_id)})
 
-def is_execution_paused():
+def is_execution_paused(run_id=DEFAULT_RUN_ID):
     """Check if execution is paused"""
-    global is_paused
-    return is_paused
+    return get_pause_gate(run_id).paused
+
+async def wait_while_paused(run_id=DEFAULT_RUN_ID):
+    """Wait until the run is resumed from the UI (returns at once if it is not paused)."""
+    await get_pause_gate(run_id).wait_resumed()
 
 def wait_for_audio_playback():
     """Main loop calls this to wait for frontend to finish playing audio"""
@@ -67,18 +415,28 @@ def wait_for_audio_playback():
     audio_playback_complete.wait()
     audio_playback_complete.clear()  # Reset for next message
 
-def run_app():
-    app.run(port=5001, use_reloader=False)
-
 def start_flask_app():
-    global flask_thread
-    flask_thread = threading.Thread(target=run_app)
-    flask_thread.daemon = True  # Daemon thread will exit when main thread exits
-    flask_thread.start()
+    """
+    Starts the chat UI server in a daemon thread. The socket is bound and
+    listening when this returns, so the page can be opened right away.
+    Returns False if it is already running (several runs share one UI server)
+    or the port is taken.
+    """
+    global flask_thread, flask_server
+    with flask_thread_lock:
+        if flask_thread and flask_thread.is_alive():
+            return False
+        try:
+            flask_server = make_server("127.0.0.1", 5001, app, threaded=True)  # /events holds a thread per open page
+        except OSError as e:
+            print(f"Could not start the chat UI on port 5001: {e}")
+            return False
+        flask_thread = threading.Thread(target=flask_server.serve_forever)
+        flask_thread.daemon = True  # Daemon thread will exit when main thread exits
+        flask_thread.start()
+        return True
 
 def shutdown_flask_app():
     """Shutdown the Flask server gracefully"""
-    # Send SIGINT to trigger Flask shutdown
-    if flask_thread and flask_thread.is_alive():
-        # Flask will shut down when the main thread exits (daemon thread)
-        pass
+    if flask_server and flask_thread and flask_thread.is_alive():
+        flask_server.shutdown()
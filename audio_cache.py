@@ -0,0 +1,252 @@
+"""
+Size-bounded cache of generated audio clips in static/audio.
+
+Both TTS services store their clips here. Clips are content-addressed: the
+name is a hash of the TTS backend, the full voice configuration and the text
+(see clip_name), stored in a subdirectory named after the first two hex
+digits so no directory grows too large. Changing a voice therefore only
+misses for that voice, and the clips it no longer uses age out through LRU
+eviction.
+
+An on-disk index records the size, creation and last access time and the
+voice configuration of every clip. Once the clips take more than
+AUDIO_CACHE_MAX_BYTES, the least recently used ones are deleted. Lookups
+that find a clip count as hits and move it to the back of the eviction order.
+
+The index lives in the main process: TTS workers (threads or processes) only
+write files, and the services record the clips when their futures complete.
+
+Sweep command (reconciles the index with the directory, removes leftover
+temporary files and evicts down to the budget):
+    python audio_cache.py sweep [--max-mb 300]
+    python audio_cache.py stats
+"""
+import atexit
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+
+AUDIO_CACHE_DIR = "static/audio"
+AUDIO_CACHE_MAX_BYTES = 300 * 1024 * 1024
+AUDIO_CACHE_INDEX_FILE = ".index.json"
+AUDIO_CACHE_SAVE_INTERVAL = 5.0       # Seconds between index writes (the index is also written at exit)
+AUDIO_CACHE_TEMP_FILE_MAX_AGE = 3600  # Leftover .tmp/.pitched files older than this are swept
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav')
+_TEMP_SUFFIXES = ('.tmp.mp3', '.pitched.mp3', '.tmp.wav')
+
+
+def clip_name(backend, voice_config, text, extension="mp3"):
+    """Cache name of a clip: '<shard>/<sha256 of backend, voice config and text>.<extension>'."""
+    key = json.dumps({"backend": backend, "voice": voice_config, "text": text},
+                     sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return f"{digest[:2]}/{digest}.{extension}"
+
+
+class AudioCache:
+    def __init__(self, directory=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.index_path = self.directory / AUDIO_CACHE_INDEX_FILE
+        self._lock = threading.Lock()
+        self._entries = {}  # relative path -> {"size", "created", "last_access", "voice"}
+        self._dirty = False
+        self._last_save = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            # No (readable) index yet: rebuild it from the files on disk
+            self._entries = {}
+            self._scan_directory()
+            self._save_index()
+
+    def _scan_directory(self):
+        """Add clips that exist on disk but not in the index. Returns how many were added."""
+        added = 0
+        for path in self.directory.rglob('*'):
+            if not path.name.endswith(AUDIO_EXTENSIONS) or path.name.endswith(_TEMP_SUFFIXES):
+                continue
+            name = path.relative_to(self.directory).as_posix()
+            if name not in self._entries:
+                stat = path.stat()
+                self._entries[name] = {"size": stat.st_size, "created": stat.st_mtime,
+                                       "last_access": stat.st_mtime, "voice": None}
+                added += 1
+        self._dirty = True
+        return added
+
+    def _save_index(self):
+        temp_path = self.index_path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding="utf-8") as f:
+            json.dump(self._entries, f, default=str)
+        temp_path.replace(self.index_path)
+        self._dirty = False
+        self._last_save = time.time()
+
+    def _maybe_save_index(self):
+        if self._dirty and time.time() - self._last_save >= AUDIO_CACHE_SAVE_INTERVAL:
+            self._save_index()
+
+    def path_for(self, name):
+        return self.directory / name
+
+    def prepare_path(self, name):
+        """Path to write a new clip to, with its shard directory created."""
+        path = self.path_for(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def lookup(self, name):
+        """Returns True if the clip is cached (and non-empty), recording a hit or miss."""
+        path = self.path_for(name)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and not path.exists():
+                # Deleted behind our back
+                del self._entries[name]
+                entry = None
+                self._dirty = True
+            if entry is None and name.endswith(AUDIO_EXTENSIONS) and path.exists() and path.stat().st_size > 0:
+                # Written by an older version or another process; adopt it
+                stat = path.stat()
+                entry = self._entries[name] = {"size": stat.st_size, "created": stat.st_mtime,
+                                               "last_access": stat.st_mtime, "voice": None}
+            if entry is None:
+                self.misses += 1
+                self._maybe_save_index()
+                return False
+            entry["last_access"] = time.time()
+            self.hits += 1
+            self._dirty = True
+            self._maybe_save_index()
+            return True
+
+    def add(self, name, voice_config=None):
+        """Record a clip that was just written, then evict down to the byte budget."""
+        path = self.path_for(name)
+        if not path.exists():
+            return
+        now = time.time()
+        with self._lock:
+            self._entries[name] = {"size": path.stat().st_size, "created": now,
+                                   "last_access": now, "voice": voice_config}
+            self._evict_to_budget(keep=name)
+            self._dirty = True
+            self._maybe_save_index()
+
+    def _total_bytes(self):
+        return sum(entry["size"] for entry in self._entries.values())
+
+    def _evict_to_budget(self, keep=None):
+        """Delete least recently used clips until the cache fits max_bytes. Returns bytes freed."""
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return 0
+        freed = 0
+        for name, entry in sorted(self._entries.items(), key=lambda item: item[1]["last_access"]):
+            if total - freed <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                self.path_for(name).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Could not evict audio clip {name}: {e}")
+                continue
+            freed += entry["size"]
+            del self._entries[name]
+            self.evictions += 1
+        self._dirty = True
+        return freed
+
+    def sweep(self):
+        """
+        Reconcile the index with the directory (drop entries whose file is gone,
+        adopt untracked clips, delete stale temporary files) and evict down to the
+        byte budget. Returns a summary dict.
+        """
+        with self._lock:
+            missing = [name for name in self._entries if not self.path_for(name).exists()]
+            for name in missing:
+                del self._entries[name]
+            adopted = self._scan_directory()
+            temp_files_removed = 0
+            cutoff = time.time() - AUDIO_CACHE_TEMP_FILE_MAX_AGE
+            for path in self.directory.rglob('*'):
+                if path.name.endswith(_TEMP_SUFFIXES) and path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    temp_files_removed += 1
+            evictions_before = self.evictions
+            freed = self._evict_to_budget()
+            self._save_index()
+            return {
+                "missing_entries_removed": len(missing),
+                "untracked_clips_adopted": adopted,
+                "temp_files_removed": temp_files_removed,
+                "clips_evicted": self.evictions - evictions_before,
+                "bytes_freed": freed,
+                "clips": len(self._entries),
+                "bytes": self._total_bytes(),
+            }
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "clips": len(self._entries),
+                "bytes": self._total_bytes(),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+# Global audio caches shared by the TTS services of the process (one per directory)
+_audio_caches = {}
+_audio_caches_lock = threading.Lock()
+
+def get_audio_cache(directory=AUDIO_CACHE_DIR):
+    key = str(Path(directory).resolve())
+    with _audio_caches_lock:
+        if key not in _audio_caches:
+            _audio_caches[key] = AudioCache(directory)
+            # Index writes are batched; write the pending changes when the process exits
+            atexit.register(_audio_caches[key].flush)
+        return _audio_caches[key]
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Manage the generated audio cache")
+    parser.add_argument("command", choices=["sweep", "stats"])
+    parser.add_argument("--dir", default=AUDIO_CACHE_DIR, help="audio cache directory")
+    parser.add_argument("--max-mb", type=float, default=AUDIO_CACHE_MAX_BYTES / (1024 * 1024),
+                        help="byte budget in megabytes")
+    args = parser.parse_args()
+
+    cache = AudioCache(args.dir, max_bytes=int(args.max_mb * 1024 * 1024))
+    if args.command == "sweep":
+        result = cache.sweep()
+    else:
+        result = cache.stats()
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,86 @@
+"""
+In-process pitch and tempo shifting for TTS clips.
+
+Does the same as the ffmpeg filter chain
+asetrate=SR*pitch,atempo=tempo,aresample=SR without launching a process:
+the samples are resampled by the pitch factor (pitch and duration both scale,
+like playing the clip at a different rate), then a waveform-similarity
+overlap-add (WSOLA) time stretch changes the tempo while keeping the new pitch.
+Resampling and the frame alignment search are vectorised with numpy and work
+on a whole clip in memory.
+"""
+import numpy as np
+
+OLA_FRAME_SIZE = 1024    # Samples per overlap-add frame (~43 ms at 24 kHz)
+OLA_SEARCH_RADIUS = 256  # How far (in samples) a frame may move to line up with the previous one
+
+
+def resample(samples, factor):
+    """
+    Resample so the clip plays `factor` times higher and faster at the same
+    sample rate (factor < 1 lowers the pitch and lengthens the clip).
+    """
+    length = int(len(samples) / factor)
+    if length < 2:
+        return samples
+    positions = np.arange(length) * factor
+    source = np.arange(len(samples))
+    if samples.ndim == 1:
+        return np.interp(positions, source, samples)
+    return np.stack([np.interp(positions, source, samples[:, channel]) for channel in range(samples.shape[1])], axis=1)
+
+
+def time_stretch(samples, tempo, frame_size=OLA_FRAME_SIZE, search_radius=OLA_SEARCH_RADIUS):
+    """
+    Change the speed of a clip without changing its pitch (tempo > 1 makes it
+    faster and shorter) using WSOLA: frames are read every frame_size/2 * tempo
+    samples and overlap-added every frame_size/2 samples, and each frame is
+    moved by up to search_radius samples to the position that best continues
+    the waveform of the previous one, so the overlaps stay in phase.
+    """
+    if samples.ndim > 1:
+        return np.stack([time_stretch(samples[:, channel], tempo, frame_size, search_radius)
+                         for channel in range(samples.shape[1])], axis=1)
+
+    hop = frame_size // 2
+    analysis_hop = hop * tempo
+    if len(samples) < frame_size + 2 * search_radius + hop:
+        return samples
+
+    padded = np.pad(samples, (search_radius, search_radius + frame_size + hop))
+    frame_count = int((len(samples) - frame_size) / analysis_hop) + 1
+    window = np.hanning(frame_size)
+    output = np.zeros((frame_count - 1) * hop + frame_size)
+    norm = np.zeros_like(output)
+
+    previous = 0  # Input position of the previous frame (in the unpadded signal)
+    for frame in range(frame_count):
+        position = int(round(frame * analysis_hop))
+        if frame > 0:
+            # The samples that would naturally follow the previous frame's overlap
+            template = padded[search_radius + previous + hop:search_radius + previous + 2 * hop]
+            candidates = padded[position:position + 2 * search_radius + hop]
+            correlation = np.correlate(candidates, template, mode='valid')
+            position = position - search_radius + int(np.argmax(correlation))
+            position = min(max(position, 0), len(samples) - 1)
+        chunk = padded[search_radius + position:search_radius + position + frame_size]
+        start = frame * hop
+        output[start:start + frame_size] += chunk * window
+        norm[start:start + frame_size] += window
+        previous = position
+
+    return output / np.maximum(norm, 1e-3)
+
+
+def shift_pitch_and_tempo(samples, pitch_factor, tempo_factor):
+    """
+    pitch_factor < 1.0 lowers the pitch (more masculine), > 1.0 raises it.
+    tempo_factor > 1.0 speeds up playback, < 1.0 slows it down.
+    The result lasts 1 / (pitch_factor * tempo_factor) times as long, as with ffmpeg.
+    """
+    shifted = samples
+    if pitch_factor != 1.0:
+        shifted = resample(shifted, pitch_factor)
+    if tempo_factor != 1.0:
+        shifted = time_stretch(shifted, tempo_factor)
+    return np.clip(shifted, -1.0, 1.0)
@@ -0,0 +1,237 @@
+"""
+Headless batch runner: sweeps a directory (or glob) of scenario files and runs
+every scenario concurrently, without the chat UI, the browser or TTS.
+
+Each run writes a transcript to the output directory, and the batch ends with a
+summary table (turns, tool calls, wall time, tokens) written as summary.md and
+summary.json.
+
+Usage:
+    python run_scenario.py --batch scenarios/ [--workers 4] [--out batch_results]
+    python run_scenario.py --batch "scenarios/*.json"
+"""
+import asyncio
+import glob
+import json
+import os
+import re
+import time
+
+BATCH_WORKERS = 4                 # Scenarios allowed to run at the same time
+BATCH_OUTPUT_DIR = "batch_results"
+
+
+def _strip_order_prefix(name):
+    """'1_prior_auth_patient_agent' -> 'prior_auth_patient_agent'"""
+    return re.sub(r'^\d+_', '', name)
+
+
+def _find_agent(agent_id, agent_files):
+    """Find an agent definition by agentId, falling back to the file name."""
+    for path, agent in agent_files.items():
+        if agent.get('agentId') == agent_id:
+            return agent
+    for path, agent in agent_files.items():
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if _strip_order_prefix(stem) == agent_id:
+            return agent
+    return None
+
+
+def _normalize_combined_agents(agents, path):
+    """
+    Older combined files have no agentName; it defaults to the agentId. Returns
+    the agents (copies) or None, with a warning, if one lacks agentId or situation.
+    """
+    normalized = []
+    for agent in agents:
+        if not isinstance(agent, dict) or not agent.get('agentId') or not agent.get('situation'):
+            print(f"WARNING: Scenario {path} has an agent without 'agentId' or 'situation'. Skipping it.")
+            return None
+        normalized.append({"agentName": agent['agentId'], **agent})
+    return normalized
+
+
+def load_scenario_file(path, agent_files=None):
+    """
+    Loads a scenario file into the combined format used by /run-scenario
+    ({"scenario": {...}, "agents": [...]}).
+
+    Combined files (as in processed_scenarios/) are returned with their agents
+    normalised (see _normalize_combined_agents). Editor scenario files (as in
+    scenarios/) reference their agents by ID; those agents are resolved from
+    the other JSON files in the same directory.
+
+    Returns None for files that are not scenarios (e.g. agent definitions) and
+    for combined files whose agents cannot be used.
+    """
+    with open(path, 'r', encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        return None
+
+    if isinstance(data.get('agents'), list):
+        agents = _normalize_combined_agents(data['agents'], path)
+        return {**data, "agents": agents} if agents is not None else None
+    if data.get('type') != 'scenario' or not isinstance(data.get('agents'), dict):
+        return None
+
+    if agent_files is None:
+        agent_files = load_agent_files(os.path.dirname(path))
+    agent_refs = data['agents']
+    initiating_agent = _find_agent(agent_refs.get('initiating_agent_id'), agent_files)
+    responding_agent = _find_agent(agent_refs.get('responding_agent_id'), agent_files)
+    if not initiating_agent or not responding_agent:
+        print(f"WARNING: Could not resolve the agents of scenario {path}. Skipping it.")
+        return None
+
+    # Same assembly as the editor's "Run Scenario" button
+    initiating_agent = dict(initiating_agent)
+    if agent_refs.get('messageToUseWhenInitiatingConversation'):
+        initiating_agent['messageToUseWhenInitiatingConversation'] = agent_refs['messageToUseWhenInitiatingConversation']
+    return {
+        "scenario": {
+            "id": data.get('id'),
+            "title": data.get('title'),
+            "description": data.get('description'),
+            "background": data.get('background'),
+        },
+        "agents": [initiating_agent, responding_agent],
+    }
+
+
+def load_agent_files(directory):
+    """All agent definitions (JSON files with "type": "agent") in a directory."""
+    agent_files = {}
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path, 'r', encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if isinstance(data, dict) and data.get('type') == 'agent':
+            agent_files[path] = data
+    return agent_files
+
+
+def discover_scenarios(targets):
+    """
+    Expands directories and glob patterns into a list of (path, scenario_data).
+    Files that are not scenarios are skipped.
+    """
+    paths = []
+    for target in targets:
+        if os.path.isdir(target):
+            paths.extend(glob.glob(os.path.join(target, '*.json')))
+        else:
+            paths.extend(glob.glob(target))
+
+    scenarios = []
+    agent_files_by_dir = {}
+    for path in sorted(set(paths)):
+        directory = os.path.dirname(path)
+        if directory not in agent_files_by_dir:
+            agent_files_by_dir[directory] = load_agent_files(directory)
+        try:
+            scenario_data = load_scenario_file(path, agent_files_by_dir[directory])
+        except (OSError, ValueError) as e:
+            print(f"WARNING: Could not read {path}: {e}. Skipping it.")
+            continue
+        if scenario_data is not None:
+            scenarios.append((path, scenario_data))
+    return scenarios
+
+
+def write_transcript(path, title, transcript):
+    """Writes the UI messages of one run as a plain text transcript."""
+    lines = [title, "=" * len(title), ""]
+    for message in transcript:
+        if message.get('type') == 'tool':
+            lines.append(f"    ({message['content']})")
+            lines.append("")
+        else:
+            lines.append(f"({message['responding_agent_id']})")
+            lines.append("")
+            lines.append(message['content'])
+            lines.append("")
+    with open(path, 'w', encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def format_summary_table(rows):
+    """Markdown table with one row per run."""
+    header = ("| Scenario | Status | Turns | Tool calls | Wall time (s) | Input tokens | Output tokens "
+              "| Cache read tokens | Cache write tokens |")
+    lines = [header, "|---|---|---|---|---|---|---|---|---|"]
+    for row in rows:
+        lines.append(
+            f"| {row['name']} | {row['status']} | {row['turns']} | {row['tool_calls']} "
+            f"| {row['wall_time']:.1f} | {row['input_tokens']} | {row['output_tokens']} "
+            f"| {row['cache_read_input_tokens']} | {row['cache_creation_input_tokens']} |"
+        )
+    return "\n".join(lines)
+
+
+async def run_batch(targets, run_one, workers=BATCH_WORKERS, output_dir=BATCH_OUTPUT_DIR):
+    """
+    Runs every scenario found in targets, at most `workers` at a time.
+
+    Args:
+        targets: directories and/or glob patterns.
+        run_one: async function called as run_one(scenario_data, run_id) that
+            returns the result dict of run_scenario.run_conversation.
+        workers: concurrency limit.
+        output_dir: where transcripts and the summary are written.
+
+    Returns:
+        The list of summary rows.
+    """
+    scenarios = discover_scenarios(targets)
+    if not scenarios:
+        print(f"No scenarios found in {', '.join(targets)}")
+        return []
+
+    os.makedirs(output_dir, exist_ok=True)
+    semaphore = asyncio.Semaphore(workers)
+    print(f"Running {len(scenarios)} scenarios with {workers} workers...")
+
+    async def run_and_record(path, scenario_data):
+        name = os.path.splitext(os.path.basename(path))[0]
+        title = (scenario_data.get('scenario') or scenario_data).get('title') or name
+        row = {"name": name, "path": path, "status": "failed", "turns": 0, "tool_calls": 0,
+               "wall_time": 0.0, "input_tokens": 0, "output_tokens": 0,
+               "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0, "error": None}
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await run_one(scenario_data, name)
+                if result:
+                    row.update({
+                        "status": "ended" if result["ended"] else "max_turns",
+                        "turns": result["turns"],
+                        "tool_calls": result["tool_calls"],
+                        "input_tokens": result["tokens"]["input_tokens"],
+                        "output_tokens": result["tokens"]["output_tokens"],
+                        "cache_read_input_tokens": result["tokens"]["cache_read_input_tokens"],
+                        "cache_creation_input_tokens": result["tokens"]["cache_creation_input_tokens"],
+                    })
+                    write_transcript(os.path.join(output_dir, f"{name}_transcript.txt"), title, result["transcript"])
+                else:
+                    row["error"] = "The conversation could not be started"
+            except Exception as e:
+                print(f"Error running scenario {path}: {e}")
+                row["error"] = str(e)
+            row["wall_time"] = time.perf_counter() - start
+        print(f"--- Finished {name}: {row['status']} in {row['wall_time']:.1f}s ---")
+        return row
+
+    rows = await asyncio.gather(*(run_and_record(path, data) for path, data in scenarios))
+
+    table = format_summary_table(rows)
+    with open(os.path.join(output_dir, "summary.md"), 'w', encoding="utf-8") as f:
+        f.write(table + "\n")
+    with open(os.path.join(output_dir, "summary.json"), 'w', encoding="utf-8") as f:
+        json.dump(rows, f, indent=2)
+    print("\n" + table)
+    print(f"\nTranscripts and summary written to {output_dir}/")
+    return rows
@@ -1,31 +1,218 @@
+import asyncio
+import contextvars
 import json
 import os
 import re
+import time
 from dotenv import load_dotenv
-from agent_squad.agents import AnthropicAgent, AnthropicAgentOptions
-from tool_surrogate_prompt_builder import build_tool_surrogate_prompt
-from agent_squad.types import ConversationMessage
+from anthropic import AsyncAnthropic
+from agent_squad.agents import AnthropicAgent, AnthropicAgentOptions, AgentStreamResponse
+from tool_surrogate_prompt_builder import RenderedHistory, SurrogatePromptTemplate, compile_surrogate_prompts
+from tool_surrogate_engine import get_surrogate_engine
+from tool_surrogate_cache import get_surrogate_cache, content_digest
+from history_window import HistoryWindow, HISTORY_TOKEN_BUDGET, HISTORY_SUMMARY_MAX_TOKENS
+from agent_squad.types import ConversationMessage, ParticipantRole
+from agent_squad.utils import AgentTools
+from agent_squad.utils.tool import AgentToolResult
 from typing import List, Dict, Optional, Union, AsyncIterable
 
 
-SCENARIO = None
-AGENT_CONFIG = None
-INPUT_TEXT = None
-CHAT_HISTORY = None
-ANTHROPIC_AGENT = None
-TOOL_CALLS_THIS_TURN = []
+PROMPT_CACHING = True        # Mark the system prompt, tools and stable history prefix as cacheable
+MAX_PARALLEL_TOOL_CALLS = 4  # Default cap on tool calls run at once (override with tool_config['toolMaxParallelCalls'])
+HISTORY_WINDOW = True        # Send a token-budgeted window of the history plus a rolling summary (see history_window.py)
 
 load_dotenv()
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
+class ToolContext:
+    """
+    Everything a tool surrogate needs to know about the request that triggered it.
+    One is created per process_request call and published through TOOL_CONTEXT,
+    so concurrent agents and sessions each see their own context.
+    """
+    def __init__(self, agent, scenario, agent_config, chat_history, input_text, user_id, session_id, rendered_history=None):
+        self.agent = agent
+        self.scenario = scenario
+        self.agent_config = agent_config
+        self.chat_history = chat_history
+        self.rendered_history = rendered_history  # RenderedHistory of the session, shared by its tool calls
+        self.input_text = input_text
+        self.user_id = user_id
+        self.session_id = session_id
+        self.tool_calls = []  # {"name", "seconds", "cached"} of each tool called during this turn, in call order
+
+# contextvars are copied into every task spawned from the request, so tool
+# functions always read the context of the turn that called them
+TOOL_CONTEXT = contextvars.ContextVar("tool_context", default=None)
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+END_OF_CONVERSATION = "END OF CONVERSATION"
+
+
+class TurnResult:
+    """
+    Outcome of one agent turn, built once when the response is complete: the
+    reply text, the tools called during the turn (with the seconds each took),
+    whether the reply ends the conversation, and whether a raw toolUse block
+    leaked into the text. The turn loop reads these instead of parsing the reply.
+    """
+    def __init__(self, text, tool_calls=()):
+        self.text = (text or "").strip()
+        self.tool_calls = list(tool_calls)
+        self.ended = END_OF_CONVERSATION in self.text
+        self.leaked_tool_use = 'toolUse' in self.text
+
+    @classmethod
+    def from_message(cls, message, tool_calls=()):
+        """
+        Content blocks are dicts ({'text': ...}, as agent_squad builds them for
+        streamed replies) or SDK objects (TextBlock, ToolUseBlock, ... for
+        single responses). Only text blocks count.
+        """
+        content = message.content if message is not None and message.content else []
+        return cls("".join(_block_text(block) for block in content), tool_calls)
+
+
+def _block_text(block):
+    if isinstance(block, dict):
+        return block.get('text', '') if block.get('type', 'text') == 'text' else ''
+    if getattr(block, 'type', None) == 'text':
+        return getattr(block, 'text', '') or ''
+    return ''
+
+
+def usage_to_dict(usage):
+    """Token counts of an Anthropic response, including prompt cache reads and writes."""
+    return {
+        "input_tokens": usage.input_tokens,
+        "output_tokens": usage.output_tokens,
+        "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+        "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+    }
+
+_FENCED = re.compile(r'```(?:\w+)?\s*(.*?)\s*```', re.DOTALL)
+
 def strip_fences(text):
-    return (match.group(1).strip() if (match := re.search(r'```(?:\w+)?\s*(.*?)\s*```', text, re.DOTALL)) else text)
+    return (match.group(1).strip() if (match := _FENCED.search(text)) else text)
+
+class AsyncAnthropicAgent(AnthropicAgent):
+    """
+    Anthropic agent whose non-streaming calls await the async client.
+    The base class calls the blocking client from inside a coroutine, which
+    stalls every other conversation sharing the same event loop.
+    """
+    def __init__(self, options: AnthropicAgentOptions):
+        super().__init__(options)
+        # Streaming agents already have an async client; share its connection pool
+        if isinstance(self.client, AsyncAnthropic):
+            self.async_client = self.client
+        else:
+            self.async_client = AsyncAnthropic(api_key=options.api_key)
+        self.token_usage = {"input_tokens": 0, "output_tokens": 0, "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+        self.last_turn_usage = dict(self.token_usage)
+
+    def add_token_usage(self, usage):
+        for key in self.token_usage:
+            self.token_usage[key] += usage.get(key, 0)
+
+    async def handle_single_response(self, input_data: dict):
+        await self.callbacks.on_llm_start(self.name, payload_input=input_data.get('messages')[-1], **input_data)
+        response = await self.async_client.messages.create(**input_data)
+        self.add_token_usage(usage_to_dict(response.usage))
+        await self.callbacks.on_llm_end(
+            self.name,
+            output=response.content,
+            usage={
+                "inputTokens": response.usage.input_tokens,
+                "outputTokens": response.usage.output_tokens,
+                "totalTokens": response.usage.input_tokens + response.usage.output_tokens,
+            },
+        )
+        return response
+
+    async def handle_streaming_response(self, payload_input):
+        """Streams like the base class, and records the token usage of the final message."""
+        async for chunk in super().handle_streaming_response(payload_input):
+            if chunk.final_message is not None and getattr(chunk.final_message, "usage", None):
+                self.add_token_usage(usage_to_dict(chunk.final_message.usage))
+            yield chunk
 
-class CustomAnthropicAgent(AnthropicAgent):
+class CustomAnthropicAgent(AsyncAnthropicAgent):
     """
     The custom Anthropic agent uses an tool surrogate to generate
     realistic tool outputs for surrogate tools.
     """
+    def __init__(self, options: AnthropicAgentOptions):
+        super().__init__(options)
+        self.history_windows = {}  # session_id -> HistoryWindow
+        self.rendered_histories = {}  # session_id -> RenderedHistory for tool surrogate prompts
+        self.surrogate_prompts = {}  # tool name -> SurrogatePromptTemplate, compiled by compile_prompts()
+        self.surrogate_cache_scope = None  # content_digest of the scenario and agent config, set by compile_prompts()
+        self.last_turn_result = None  # TurnResult of the latest request, set once its response is complete
+
+    def compile_prompts(self, scenario):
+        """Renders the static sections of the surrogate prompt of every tool once, at scenario load."""
+        self.surrogate_prompts = compile_surrogate_prompts(scenario, self.agent_config)
+        self.surrogate_cache_scope = content_digest(scenario, self.agent_config)
+
+    def update_system_prompt(self):
+        """
+        The base class re-substitutes the template's placeholders on every turn.
+        The system prompt is built once by the agent factory and has no variables,
+        so it is used as is.
+        """
+        if self.custom_variables:
+            super().update_system_prompt()
+        else:
+            self.system_prompt = self.prompt_template
+
+    async def _windowed_history(self, chat_history, session_id, agent_config):
+        """The history to send this turn: recent messages within the token budget, after a summary of the rest."""
+        if not HISTORY_WINDOW:
+            return chat_history
+        window = self.history_windows.get(session_id)
+        if window is None:
+            window = self.history_windows[session_id] = HistoryWindow(
+                token_budget=agent_config.get('historyTokenBudget', HISTORY_TOKEN_BUDGET)
+            )
+
+        async def summarize(prompt):
+            return await get_surrogate_engine().complete(prompt, max_tokens=HISTORY_SUMMARY_MAX_TOKENS)
+
+        windowed_history, usage = await window.apply(chat_history, summarize)
+        if usage:
+            # Summary tokens are billed to the agent whose history is summarised
+            self.add_token_usage(usage)
+        return windowed_history
+
+    def _build_input(self, messages, system_prompt):
+        """
+        Adds prompt cache breakpoints to the request. The system prompt and the
+        tool definitions never change during a conversation, and the saved
+        history only grows at the end, so the provider can reuse all of them
+        from one turn to the next instead of reprocessing them.
+        """
+        json_input = super()._build_input(messages, system_prompt)
+        if not PROMPT_CACHING:
+            return json_input
+
+        # Breakpoint 1: tools (they come first in the cached prefix)
+        if json_input.get("tools"):
+            json_input["tools"] = [dict(tool) for tool in json_input["tools"]]
+            json_input["tools"][-1]["cache_control"] = CACHE_CONTROL
+        # Breakpoint 2: system prompt
+        json_input["system"] = [{"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}]
+        # Breakpoint 3: the last saved history message, just before the new input
+        history_messages = json_input["messages"][:-1]
+        if history_messages and isinstance(history_messages[-1]["content"], str) and history_messages[-1]["content"]:
+            last = history_messages[-1]
+            json_input["messages"][len(history_messages) - 1] = {
+                "role": last["role"],
+                "content": [{"type": "text", "text": last["content"], "cache_control": CACHE_CONTROL}],
+            }
+        return json_input
+
     async def process_request(
         self,
         input_text: str,
@@ -37,42 +224,97 @@ class CustomAnthropicAgent(AnthropicAgent):
         """
         Overrides the base method to inject tool surrogate logic for surrogate tools.
         """
-        global SCENARIO, AGENT_CONFIG, INPUT_TEXT, CHAT_HISTORY, USER_ID, SESSION_ID, TOOL_CALLS_THIS_TURN
-        TOOL_CALLS_THIS_TURN = []
-        SCENARIO = additional_params.get("scenario")
-        AGENT_CONFIG = additional_params.get("agent_config")
-        CHAT_HISTORY = chat_history
-        INPUT_TEXT = input_text
-        USER_ID = user_id
-        SESSION_ID = session_id
-
-        if not SCENARIO or not AGENT_CONFIG:
+        scenario = additional_params.get("scenario") if additional_params else None
+        agent_config = additional_params.get("agent_config") if additional_params else None
+
+        if not scenario or not agent_config:
             print("--- DEBUG: Missing scenario or agent_config ---")
             return ConversationMessage(role="assistant", content=[{"type": "text", "text": "Error: Missing scenario or agent_config"}])
 
+        usage_before = dict(self.token_usage)
+        # Tools still see the full history; the model gets the window
+        windowed_history = await self._windowed_history(chat_history, session_id, agent_config)
+
         print(f"\n======= START CustomAnthropicAgent.process_request ========")
-        print(f"Chat history received has {len(chat_history)} elements:\n")
-        for message in chat_history:
+        print(f"Chat history received has {len(chat_history)} elements, sending {len(windowed_history)}:\n")
+        for message in windowed_history:
            print(f"  - Role: {message.role}, Content: {str(message.content)[0:200]}...\n")
         print(f"  current message: {input_text[0:200]}...")
-        print(f"  current agent_config: {AGENT_CONFIG['agentId']}")
+        print(f"  current agent_config: {agent_config['agentId']}")
         print(f"\n======= END CustomAnthropicAgent.process_request ========")
 
-        result = await super().process_request(input_text, user_id, session_id, chat_history, additional_params)
-        
-        if TOOL_CALLS_THIS_TURN:
-            tool_markers = "".join([f"[TOOL_CALL]{tool_name}[/TOOL_CALL]" for tool_name in TOOL_CALLS_THIS_TURN])
-            if isinstance(result, ConversationMessage):
-                original_text = result.content[0].get('text', '')
-                result.content[0]['text'] = f"{tool_markers}{original_text}"
-            else: # It's an async iterable (streaming)
-                async def stream_wrapper():
-                    yield tool_markers
-                    async for chunk in result:
-                        yield chunk
-                return stream_wrapper()
-
-        return result
+        rendered_history = self.rendered_histories.setdefault(session_id, RenderedHistory())
+        context = ToolContext(self, scenario, agent_config, chat_history, input_text, user_id, session_id, rendered_history)
+        token = TOOL_CONTEXT.set(context)
+        self.last_turn_result = None
+        try:
+            result = await super().process_request(input_text, user_id, session_id, windowed_history, additional_params)
+        finally:
+            TOOL_CONTEXT.reset(token)
+        if isinstance(result, ConversationMessage):
+            self._report_turn_usage(agent_config['agentId'], usage_before)
+            self.last_turn_result = TurnResult.from_message(result, context.tool_calls)
+            return result
+
+        # It's an async iterable (streaming): the tools run while the stream is
+        # consumed, so the context has to be active during iteration. Chunks
+        # pass straight through; the turn result is built from the final message.
+        async def stream_wrapper():
+            stream_token = TOOL_CONTEXT.set(context)
+            text_chunks = []
+            try:
+                async for chunk in result:
+                    if isinstance(chunk, AgentStreamResponse):
+                        if chunk.final_message:
+                            self._report_turn_usage(agent_config['agentId'], usage_before)
+                            self.last_turn_result = TurnResult.from_message(chunk.final_message, context.tool_calls)
+                        elif chunk.text:
+                            text_chunks.append(chunk.text)
+                    yield chunk
+                if self.last_turn_result is None:
+                    self.last_turn_result = TurnResult("".join(text_chunks), context.tool_calls)
+            finally:
+                try:
+                    TOOL_CONTEXT.reset(stream_token)
+                except ValueError:
+                    # Closed from another context (e.g. garbage collected); that context never saw the token
+                    pass
+        return stream_wrapper()
+
+    def _report_turn_usage(self, agent_id, usage_before):
+        """Sets last_turn_usage to the tokens used since usage_before and prints them."""
+        self.last_turn_usage = {key: self.token_usage[key] - usage_before[key] for key in self.token_usage}
+        print(f"--- Turn tokens for {agent_id}: input={self.last_turn_usage['input_tokens']}, "
+              f"output={self.last_turn_usage['output_tokens']}, "
+              f"cache read={self.last_turn_usage['cache_read_input_tokens']}, "
+              f"cache write={self.last_turn_usage['cache_creation_input_tokens']} ---")
+
+    async def _process_tool_block(self, llm_response, conversation, agent_tracking_info=None):
+        """
+        Runs every tool_use block of one model response concurrently instead of one
+        after another; each surrogate call is a full LLM round trip. At most
+        tool_config['toolMaxParallelCalls'] tools run at once, and the tool_result
+        blocks are returned in the same order as the tool_use blocks.
+        """
+        tools = self.tool_config["tool"]
+        if "useToolHandler" in self.tool_config or not isinstance(tools, AgentTools):
+            return await super()._process_tool_block(llm_response, conversation, agent_tracking_info)
+
+        tool_use_blocks = [block for block in llm_response.content if getattr(block, "type", None) == "tool_use"]
+        semaphore = asyncio.Semaphore(self.tool_config.get("toolMaxParallelCalls", MAX_PARALLEL_TOOL_CALLS))
+        agent_info = {"agent_name": self.name, "agent_tracking_info": agent_tracking_info}
+
+        async def run_tool(block):
+            async with semaphore:
+                await tools.callbacks.on_tool_start(block.name, block.input, metadata={"agent_info": agent_info})
+                result = await tools._process_tool(block.name, block.input)
+                await tools.callbacks.on_tool_end(block.name, block.input, result, metadata={"agent_info": agent_info})
+            return AgentToolResult(block.id, result).to_anthropic_format()
+
+        if len(tool_use_blocks) > 1:
+            print(f"--- Running {len(tool_use_blocks)} tool calls concurrently ---")
+        tool_results = await asyncio.gather(*(run_tool(block) for block in tool_use_blocks))
+        return {"role": ParticipantRole.USER.value, "content": list(tool_results)}
 
 async def tool_surrogate_func(*args, **kwargs):
     """A surrogate for tools that are defined in the scenario but not yet implemented."""
@@ -82,10 +324,15 @@ async def tool_surrogate_func(*args, **kwargs):
         return("Unable to execute unnamed tool. Make sure the 'tool_name' parameter is always provided when requesting tool execution.")
     #print(f"--- Tool {tool_name} called with inputs: {kwargs} ---")
     print(f"--- Tool {tool_name} called ---")
-    global TOOL_CALLS_THIS_TURN
-    TOOL_CALLS_THIS_TURN.append(tool_name)
+    context = TOOL_CONTEXT.get()
+    if context is None:
+        print(f"WARNING: Tool {tool_name} was called outside of an agent request. SKIPPING.")
+        return "Tool failed to execute."
+    call = {"name": tool_name, "seconds": None, "cached": False}
+    context.tool_calls.append(call)
+    started = time.perf_counter()
     current_tool_config = None
-    for tool_config in AGENT_CONFIG.get('tools', []):
+    for tool_config in context.agent_config.get('tools', []):
         if tool_config.get('toolName') == tool_name:
             current_tool_config = tool_config
             break
@@ -93,34 +340,35 @@ async def tool_surrogate_func(*args, **kwargs):
         print(f"--- DEBUG: Cannot find tool config for {tool_name} ---")
         return "Tool failed to execute."
 
-    prompt = build_tool_surrogate_prompt(
-        scenario=SCENARIO,
-        agent_config=AGENT_CONFIG,
-        tool_name = tool_name,
-        tool_config = current_tool_config,
-        args=kwargs,
-        chat_history=CHAT_HISTORY,
-    )
-    #print(f"--- DEBUG: created surrogate prompt", type(prompt))
-    # Call the LLM with the prompt using a very simple agent that has no tools, no customization
-    SimpleAgent= AnthropicAgent(AnthropicAgentOptions(
-        name='Anthropic Assistant',
-        description='A simple AI assistant',
-        api_key=ANTHROPIC_API_KEY,
-        model_id = 'claude-haiku-4-5-20251001',
-        streaming=False
-    ))
-
-    response = await SimpleAgent.process_request(prompt, USER_ID, SESSION_ID, [])
-    # The response from the LLM is a ConversationMessage, e.g., (role="assistant", content=[{"type": "text", "text": "Error: Missing scenario or agent_config"}])
-    trimmed_response = strip_fences(response.content[0].get('text', 'Error: No text included in the tool agent response.'))
-    #print(f"--- Response from surrogate tool (trimmed): {' '.join(trimmed_response[0:100].replace(newline_char,' ').split())}")
+    cache = get_surrogate_cache()
+    cache_key = cache.make_key(context.scenario, context.agent_config, tool_name, kwargs, context.chat_history,
+                               getattr(context.agent, "surrogate_cache_scope", None)) if cache else None
+    trimmed_response = cache.get(cache_key) if cache else None
+    if trimmed_response is not None:
+        call["cached"] = True
+        print(f"--- Tool {tool_name} result served from the surrogate cache ---")
+    else:
+        template = getattr(context.agent, "surrogate_prompts", {}).get(tool_name)
+        if template is None:
+            # Agent created without compile_prompts(): compile this tool's template now
+            template = SurrogatePromptTemplate(context.scenario, context.agent_config, tool_name, current_tool_config)
+        prompt = template.render(kwargs, context.chat_history, context.rendered_history)
+        #print(f"--- DEBUG: created surrogate prompt", type(prompt))
+        # Call the LLM with the prompt through the shared surrogate engine (no tools, no customization)
+        response_text, usage = await get_surrogate_engine().complete(prompt)
+        # Surrogate tokens are billed to the agent that called the tool
+        context.agent.add_token_usage(usage)
+        trimmed_response = strip_fences(response_text or 'Error: No text included in the tool agent response.')
+        #print(f"--- Response from surrogate tool (trimmed): {' '.join(trimmed_response[0:100].replace(newline_char,' ').split())}")
+        if cache and response_text:
+            cache.put(cache_key, trimmed_response)
     
     # Check if the tool is meant to end the conversation
     if current_tool_config.get("endsConversation"):
         print(f"--- Tool {tool_name} is configured to end the conversation. ---")
         trimmed_response += "\nSTART WRAPPING UP THE CONVERSATION"
-        
+
+    call["seconds"] = time.perf_counter() - started
     return trimmed_response
 
 # not used
@@ -3,16 +3,20 @@ Text-to-Speech service using Google Cloud TTS API.
 Provides high-quality voices without requiring pitch shifting.
 """
 import os
-import hashlib
 from pathlib import Path
-import threading
-import queue
+from concurrent.futures import Future
 from google.cloud import texttospeech
+from audio_cache import get_audio_cache, clip_name
+from tts_backends import TTSBackend
+from tts_worker_pool import TTSWorkerPool, TTS_WORKERS, TTS_MAX_QUEUE
 
-class GoogleCloudTTSService:
-    def __init__(self, audio_dir="static/audio"):
+class GoogleCloudTTSService(TTSBackend):
+    name = "google"
+
+    def __init__(self, audio_dir="static/audio", workers=TTS_WORKERS, max_queue=TTS_MAX_QUEUE):
         self.audio_dir = Path(audio_dir)
         self.audio_dir.mkdir(parents=True, exist_ok=True)
+        self.cache = get_audio_cache(audio_dir)
         
         # Initialize Google Cloud TTS client
         try:
@@ -22,10 +26,10 @@ class GoogleCloudTTSService:
             print(f"Error initializing Google Cloud TTS: {e}")
             raise
         
-        # Queue for async audio generation
-        self.generation_queue = queue.Queue()
-        self.worker_thread = threading.Thread(target=self._process_queue, daemon=True)
-        self.worker_thread.start()
+        # Worker pool for async audio generation; synthesis is a network call,
+        # so several requests run side by side on threads (the client is thread-safe)
+        self.pool = TTSWorkerPool(self._generate_audio_url, workers=workers, max_queue=max_queue,
+                                  name="google-tts")
         
         # Voice configurations for different speakers
         # No pitch shifting needed - these voices are already optimized
@@ -40,10 +44,19 @@ class GoogleCloudTTSService:
             }
         }
     
+    def _voice_key(self, speaker_id):
+        """Everything about the voice that changes the audio (used in the cache name)."""
+        voice_config = self.voice_configs.get(speaker_id, self.voice_configs["speaker1"])
+        return {
+            "language_code": "en-US",
+            "name": voice_config["name"],
+            "gender": voice_config["gender"].name,
+            "encoding": "MP3",
+        }
+    
     def _get_audio_filename(self, text, speaker_id):
-        """Generate a unique filename based on text and speaker."""
-        text_hash = hashlib.md5(f"{speaker_id}:{text}".encode()).hexdigest()
-        return f"{text_hash}.mp3"
+        """Cache name of the clip: depends on the text and the speaker's full voice config."""
+        return clip_name("google-cloud-tts", self._voice_key(speaker_id), text.strip())
     
     # def _add_sentence_punctuation(self, text):
     #     """Add periods to lines that don't end with proper punctuation."""
@@ -66,13 +79,13 @@ class GoogleCloudTTSService:
         
     #     return '\n'.join(processed_lines)
     
-    def _generate_audio_file(self, text, speaker_id):
+    def _generate_audio_file(self, text, speaker_id, check_cache=True):
         """Generate audio file for the given text and speaker."""
         filename = self._get_audio_filename(text, speaker_id)
-        filepath = self.audio_dir / filename
+        filepath = self.cache.prepare_path(filename)
         
-        # Skip if already exists and is non-empty
-        if filepath.exists() and filepath.stat().st_size > 0:
+        # Skip if already cached
+        if check_cache and self.cache.lookup(filename):
             return filename
         
         try:
@@ -109,13 +122,17 @@ class GoogleCloudTTSService:
                 audio_config=audio_config
             )
             
-            # Write the response to the output file
-            with open(filepath, "wb") as out:
+            # Write to a temporary file and move it into place, so a crash or a
+            # concurrent lookup never sees a partial clip at the cached path
+            temp_filepath = filepath.with_suffix('.tmp.mp3')
+            with open(temp_filepath, "wb") as out:
                 out.write(response.audio_content)
             
             # Verify file was created and has content
-            if filepath.exists() and filepath.stat().st_size > 0:
+            if temp_filepath.exists() and temp_filepath.stat().st_size > 0:
+                temp_filepath.replace(filepath)
                 print(f"Generated audio: {filename} ({filepath.stat().st_size} bytes)")
+                self.cache.add(filename, self._voice_key(speaker_id))
                 return filename
             else:
                 print(f"Error: Generated empty audio file for: {text[:50]}...")
@@ -125,23 +142,28 @@ class GoogleCloudTTSService:
             print(f"Error generating audio for '{text[:50]}...': {e}")
             return None
     
-    def _process_queue(self):
-        """Background worker to process audio generation queue."""
-        while True:
-            try:
-                task = self.generation_queue.get()
-                if task is None:
-                    break
-                
-                text, speaker_id = task
-                self._generate_audio_file(text, speaker_id)
-                self.generation_queue.task_done()
-            except Exception as e:
-                print(f"Error in TTS worker: {e}")
+    def _generate_audio_url(self, text, speaker_id):
+        # generate_audio_async has already looked the clip up in the cache
+        filename = self._generate_audio_file(text, speaker_id, check_cache=False)
+        if filename:
+            return f"/static/audio/{filename}"
+        return None
+    
+    def generate_audio_async(self, text, speaker_id, timeout=None):
+        """
+        Queue audio generation for async processing.
+        Returns a concurrent.futures.Future that resolves to the audio URL (None on failure).
+        Cached clips resolve immediately; otherwise this blocks while the generation queue is full.
+        """
+        filename = self._get_audio_filename(text, speaker_id)
+        if self.cache.lookup(filename):
+            future = Future()
+            future.set_result(f"/static/audio/{filename}")
+            return future
+        return self.pool.submit(text, speaker_id, timeout=timeout)
     
-    def generate_audio_async(self, text, speaker_id):
-        """Queue audio generation for async processing."""
-        self.generation_queue.put((text, speaker_id))
+    def stats(self):
+        return {"pool": self.pool.stats(), "cache": self.cache.stats()}
     
     def generate_audio(self, text, speaker_id):
         """Generate audio synchronously and return filename."""
@@ -149,15 +171,8 @@ class GoogleCloudTTSService:
     
     def get_audio_url(self, text, speaker_id):
         """Get the URL for the audio file (generate if needed)."""
-        filename = self._get_audio_filename(text, speaker_id)
-        filepath = self.audio_dir / filename
-        
-        if not filepath.exists():
-            filename = self._generate_audio_file(text, speaker_id)
+        filename = self._generate_audio_file(text, speaker_id)
         
         if filename:
             return f"/static/audio/{filename}"
         return None
-
-# Global TTS service instance - will be initialized by main.py
-google_cloud_tts_service = None
@@ -0,0 +1,159 @@
+"""
+Token-budgeted window over an agent's saved conversation history.
+
+The orchestrator hands every agent its full saved history on every turn, so
+without a window the input of each turn grows with the length of the
+conversation. HistoryWindow keeps the most recent messages verbatim within a
+token budget and replaces the older ones with a rolling summary:
+
+- Token counts are estimated once per message (the saved history only grows
+  at the end, so only the new messages are counted each turn).
+- When the verbatim part goes over the budget, the window jumps forward until
+  it fills only HISTORY_WINDOW_REFILL of the budget. The history sent to the
+  model then stays the same, apart from new messages at the end, for several
+  turns, so the provider's prompt cache keeps working between jumps.
+- The messages that leave the window are folded into the existing summary by
+  one short LLM call through the shared surrogate engine. Earlier turns are
+  never summarised again.
+
+The summary is sent as the first (user) message, followed by the window,
+which always starts with an assistant message so roles keep alternating.
+"""
+import asyncio
+import re
+
+HISTORY_TOKEN_BUDGET = 4000         # Tokens of verbatim history per turn (override with agentConfig['historyTokenBudget'])
+HISTORY_WINDOW_REFILL = 0.5         # After a jump, the window fills this fraction of the budget
+HISTORY_MIN_RECENT_MESSAGES = 4     # Never summarise the last few messages, whatever their size
+HISTORY_SUMMARY_MAX_TOKENS = 500
+CHARS_PER_TOKEN = 4                 # Estimate used to count tokens without calling the API
+
+SUMMARY_PREFIX = "SUMMARY OF THE EARLIER CONVERSATION (the older turns are not repeated):\n"
+
+_TURN_PREFIX = re.compile(r'^TURN (\d+): Agent (\S+) said: ', re.DOTALL)
+
+
+def message_text(message):
+    if message.content and isinstance(message.content, list) and 'text' in message.content[0]:
+        return message.content[0]['text']
+    return ""
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def summary_prompt(previous_summary, messages):
+    """Prompt that folds the given messages into the previous summary."""
+    transcript = "\n".join(f"{message.role}: {message_text(message)}" for message in messages)
+    return f"""
+<TASK>
+You maintain a running summary of a conversation between two agents so that it can be continued
+without the full transcript. Update the summary with the new part of the conversation.
+Keep every fact, decision, number, identifier, open question and commitment that may matter later;
+drop greetings and repetition. Write plain prose of at most {HISTORY_SUMMARY_MAX_TOKENS * 3 // 4} words.
+Reply with the updated summary only.
+</TASK>
+
+<PREVIOUS_SUMMARY>
+{previous_summary or "(none yet)"}
+</PREVIOUS_SUMMARY>
+
+<NEW_PART_OF_THE_CONVERSATION>
+{transcript}
+</NEW_PART_OF_THE_CONVERSATION>
+"""
+
+
+def fallback_summary(previous_summary, messages, max_chars=HISTORY_SUMMARY_MAX_TOKENS * CHARS_PER_TOKEN):
+    """Extractive summary used when the LLM call fails: the first sentence of each message."""
+    lines = [previous_summary] if previous_summary else []
+    for message in messages:
+        text = _TURN_PREFIX.sub(lambda match: f"Turn {match.group(1)}, {match.group(2)}: ", message_text(message))
+        first_sentence = re.split(r'(?<=[.!?])\s', text.strip(), maxsplit=1)[0]
+        if first_sentence:
+            lines.append(first_sentence)
+    summary = "\n".join(lines)
+    # Keep the most recent part if it grows too long
+    return summary[-max_chars:]
+
+
+class HistoryWindow:
+    """
+    Window state for one agent in one session. apply() takes the full saved
+    history and returns (history to send, summary usage) - see the module
+    docstring.
+    """
+
+    def __init__(self, token_budget=HISTORY_TOKEN_BUDGET, min_recent_messages=HISTORY_MIN_RECENT_MESSAGES):
+        self.token_budget = token_budget
+        self.min_recent_messages = min_recent_messages
+        self.token_counts = []    # Estimated tokens of each saved message, counted once
+        self.window_start = 0     # Index of the first message sent verbatim
+        self.summary = ""
+        self._lock = asyncio.Lock()
+
+    def _count_new_messages(self, history):
+        if len(history) < len(self.token_counts):
+            # The saved history was trimmed or replaced: start over
+            self.token_counts = []
+            self.window_start = 0
+            self.summary = ""
+        for message in history[len(self.token_counts):]:
+            self.token_counts.append(estimate_tokens(message_text(message)))
+
+    def _next_window_start(self, history):
+        """Where the window should start to fit the refill target, or the current start if it fits the budget."""
+        window_tokens = sum(self.token_counts[self.window_start:])
+        if window_tokens <= self.token_budget:
+            return self.window_start
+        target = self.token_budget * HISTORY_WINDOW_REFILL
+        latest_start = max(self.window_start, len(history) - self.min_recent_messages)
+        start = self.window_start
+        while start < latest_start and window_tokens > target:
+            window_tokens -= self.token_counts[start]
+            start += 1
+        # The window follows the user-role summary, so it has to start with an assistant message
+        while start < len(history) and history[start].role != "assistant":
+            start += 1
+        return start
+
+    async def apply(self, history, summarize):
+        """
+        summarize(prompt) is an async function returning (text, usage), used to
+        update the summary when messages leave the window. Returns the history
+        to send and the token usage of the summary call (None if there was none).
+        """
+        from agent_squad.types import ConversationMessage, ParticipantRole
+
+        async with self._lock:
+            self._count_new_messages(history)
+            new_start = self._next_window_start(history)
+            usage = None
+            if new_start > self.window_start:
+                leaving = history[self.window_start:new_start]
+                try:
+                    text, usage = await summarize(summary_prompt(self.summary, leaving))
+                    self.summary = text.strip() or fallback_summary(self.summary, leaving)
+                except Exception as e:
+                    print(f"--- History summary failed ({e}); using an extractive summary ---")
+                    self.summary = fallback_summary(self.summary, leaving)
+                print(f"--- History window: {new_start - self.window_start} messages folded into the summary, "
+                      f"{len(history) - new_start} kept verbatim ---")
+                self.window_start = new_start
+
+            if not self.summary:
+                return history, usage
+            summary_message = ConversationMessage(
+                role=ParticipantRole.USER.value,
+                content=[{'text': SUMMARY_PREFIX + self.summary}]
+            )
+            return [summary_message, *history[self.window_start:]], usage
+
+    def stats(self):
+        return {
+            "messages": len(self.token_counts),
+            "summarized_messages": self.window_start,
+            "window_tokens": sum(self.token_counts[self.window_start:]),
+            "summary_tokens": estimate_tokens(self.summary) if self.summary else 0,
+        }
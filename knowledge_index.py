@@ -0,0 +1,142 @@
+"""
+Lexical retrieval index over an agent's knowledge base.
+
+Tool surrogate prompts used to include the agent's whole knowledgeBase on
+every tool call, whatever the tool. KnowledgeBaseIndex splits the knowledge
+base into passages once, when the scenario is loaded, and ranks them with
+BM25 against the tool's name and description and the argument values of the
+call (which count double), so a surrogate prompt only carries the top-k
+passages that fit in a token cap.
+
+A passage is a part of the knowledge base JSON small enough to stand on its
+own, labelled with its path (e.g. policyDocuments.mriPolicy.criteria[2]). The
+path is indexed too, so "lookup_medical_policy" finds the medicalPolicies
+section even if the passage text never says "policy". Passages are returned
+in knowledge base order, not score order, so related entries stay together.
+"""
+import json
+import math
+import re
+from history_window import estimate_tokens
+
+KB_TOP_K = 8                  # Passages per surrogate prompt (override with agentConfig['knowledgeBaseTopK'])
+KB_MAX_TOKENS = 1500          # Token cap of those passages (override with agentConfig['knowledgeBaseMaxTokens'])
+KB_PASSAGE_MAX_CHARS = 600    # Larger parts of the knowledge base are split into smaller passages
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_CAMEL_CASE = re.compile(r'(?<=[a-z0-9])(?=[A-Z])')
+_WORD = re.compile(r'[^\W_]{2,}')
+
+
+def tokenize(text):
+    """Lowercase words; camelCase and snake_case names are split into their words."""
+    return _WORD.findall(_CAMEL_CASE.sub(" ", text).lower())
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def split_passages(node, path="", max_chars=KB_PASSAGE_MAX_CHARS):
+    """(path, text) passages of a JSON value: whole subtrees if they fit max_chars, else their children."""
+    text = node if isinstance(node, str) else _dumps(node)
+    if len(text) <= max_chars or not isinstance(node, (dict, list, str)):
+        return [(path, text)] if text not in ("", "{}", "[]") else []
+    passages = []
+    if isinstance(node, dict):
+        for key, value in node.items():
+            passages.extend(split_passages(value, f"{path}.{key}" if path else str(key), max_chars))
+    elif isinstance(node, list):
+        for index, value in enumerate(node):
+            passages.extend(split_passages(value, f"{path}[{index}]", max_chars))
+    else:
+        # Long text: split at sentence ends into pieces of up to max_chars
+        piece = ""
+        for sentence in re.split(r'(?<=[.!?])\s+', node):
+            if piece and len(piece) + 1 + len(sentence) > max_chars:
+                passages.append((path, piece))
+                piece = sentence
+            else:
+                piece = f"{piece} {sentence}" if piece else sentence
+        if piece:
+            passages.append((path, piece))
+    return passages
+
+
+class KnowledgeBaseIndex:
+    """BM25 index over the passages of one knowledge base. Built once; search() is read-only."""
+
+    def __init__(self, knowledge_base, max_chars=KB_PASSAGE_MAX_CHARS):
+        if isinstance(knowledge_base, str):
+            try:
+                knowledge_base = json.loads(knowledge_base)
+            except ValueError:
+                pass
+        self.passages = [f"{path}: {text}" if path else text for path, text in split_passages(knowledge_base, max_chars=max_chars)]
+        self.passage_tokens = [estimate_tokens(passage) for passage in self.passages]
+        self.postings = {}  # term -> [(passage index, term frequency)]
+        lengths = []
+        for index, passage in enumerate(self.passages):
+            terms = tokenize(passage)
+            lengths.append(len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                self.postings.setdefault(term, []).append((index, count))
+        self.lengths = lengths
+        self.average_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+        self.total_tokens = sum(self.passage_tokens)
+
+    def _idf(self, term):
+        matching = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.passages) - matching + 0.5) / (matching + 0.5))
+
+    def scores(self, query_weights):
+        """BM25 score of every passage that matches at least one query term."""
+        scores = {}
+        for term, weight in query_weights.items():
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf(term)
+            for index, frequency in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[index] / self.average_length)
+                scores[index] = scores.get(index, 0.0) + weight * idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return scores
+
+    def search(self, query_weights, top_k=KB_TOP_K, max_tokens=KB_MAX_TOKENS):
+        """
+        Up to top_k of the best matching passages that fit in max_tokens, in
+        knowledge base order. If nothing matches, the first passages that fit.
+        """
+        scores = self.scores(query_weights)
+        ranked = sorted(scores, key=lambda index: (-scores[index], index)) if scores else range(len(self.passages))
+        chosen = []
+        used = 0
+        for index in ranked:
+            if len(chosen) >= top_k:
+                break
+            if used + self.passage_tokens[index] > max_tokens:
+                continue
+            chosen.append(index)
+            used += self.passage_tokens[index]
+        return [self.passages[index] for index in sorted(chosen)]
+
+
+def tool_query_weights(tool_name, tool_config):
+    """Query terms of a tool (name and description) and their weights; computed once per tool."""
+    weights = {}
+    for term in tokenize(f"{tool_name} {tool_config.get('description', '')}"):
+        weights[term] = weights.get(term, 0) + 1
+    return weights
+
+
+def query_weights(tool_weights, args):
+    """Query terms of one tool call: the tool's terms plus the argument values, which count double."""
+    weights = dict(tool_weights)
+    values = [value for key, value in (args or {}).items() if key != 'tool_name']
+    for term in tokenize(_dumps(values)):
+        weights[term] = weights.get(term, 0) + 2
+    return weights
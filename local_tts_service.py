@@ -0,0 +1,126 @@
+"""
+Offline stand-in TTS backend: deterministic synthetic tones instead of speech.
+
+Every character becomes a short tone whose pitch depends on the character and
+the speaker (spaces become silence), written as a WAV file with the standard
+library only. Generation sleeps for a latency proportional to the text length,
+similar to a real TTS round trip, so the worker pool, the audio cache,
+sentence chunking and UI playback can be benchmarked and load tested without
+credentials or network access.
+
+Select it with TTS_BACKEND=local or --tts local.
+"""
+import math
+import struct
+import time
+import wave
+from concurrent.futures import Future
+from pathlib import Path
+from audio_cache import get_audio_cache, clip_name
+from tts_backends import TTSBackend
+from tts_worker_pool import TTSWorkerPool, TTS_WORKERS, TTS_MAX_QUEUE
+
+LOCAL_TTS_SAMPLE_RATE = 16000
+LOCAL_TTS_SECONDS_PER_CHAR = 0.04      # Length of the tone for one character
+LOCAL_TTS_BASE_LATENCY = 0.15          # Simulated request round trip, in seconds
+LOCAL_TTS_LATENCY_PER_CHAR = 0.002     # Simulated synthesis time per character
+
+
+class LocalToneTTSService(TTSBackend):
+    name = "local"
+
+    def __init__(self, audio_dir="static/audio", workers=TTS_WORKERS, max_queue=TTS_MAX_QUEUE):
+        self.audio_dir = Path(audio_dir)
+        self.audio_dir.mkdir(parents=True, exist_ok=True)
+        self.cache = get_audio_cache(audio_dir)
+        self.pool = TTSWorkerPool(self._generate_audio_url, workers=workers, max_queue=max_queue,
+                                  name="local-tts")
+
+        # Base tone of each speaker, in Hz
+        self.voice_configs = {
+            "speaker1": {"base_frequency": 220.0, "volume": 0.3},
+            "speaker2": {"base_frequency": 150.0, "volume": 0.3},
+        }
+
+    def _get_audio_filename(self, text, speaker_id):
+        """Cache name of the clip: depends on the text and the speaker's full voice config."""
+        voice_config = self.voice_configs.get(speaker_id, self.voice_configs["speaker1"])
+        key = {**voice_config, "sample_rate": LOCAL_TTS_SAMPLE_RATE, "seconds_per_char": LOCAL_TTS_SECONDS_PER_CHAR}
+        return clip_name("local-tone", key, text.strip(), extension="wav")
+
+    def _render(self, text, voice_config):
+        """16-bit mono PCM frames: one tone (or silence) per character."""
+        samples_per_char = int(LOCAL_TTS_SAMPLE_RATE * LOCAL_TTS_SECONDS_PER_CHAR)
+        amplitude = int(32767 * voice_config["volume"])
+        frames = bytearray()
+        for char in text:
+            if char.isspace():
+                frames.extend(b"\x00\x00" * samples_per_char)
+                continue
+            # Map the character onto two octaves above the speaker's base tone
+            frequency = voice_config["base_frequency"] * 2 ** ((ord(char) % 24) / 12)
+            step = 2 * math.pi * frequency / LOCAL_TTS_SAMPLE_RATE
+            frames.extend(struct.pack(
+                f"<{samples_per_char}h",
+                *(int(amplitude * math.sin(step * i)) for i in range(samples_per_char))
+            ))
+        return bytes(frames)
+
+    def _generate_audio_file(self, text, speaker_id, check_cache=True):
+        """Generate audio file for the given text and speaker."""
+        filename = self._get_audio_filename(text, speaker_id)
+        filepath = self.cache.prepare_path(filename)
+
+        # Skip if already cached
+        if check_cache and self.cache.lookup(filename):
+            return filename
+
+        clean_text = text.strip()
+        if not clean_text:
+            return None
+
+        voice_config = self.voice_configs.get(speaker_id, self.voice_configs["speaker1"])
+        time.sleep(LOCAL_TTS_BASE_LATENCY + LOCAL_TTS_LATENCY_PER_CHAR * len(clean_text))
+        temp_filepath = filepath.with_suffix('.tmp.wav')
+        with wave.open(str(temp_filepath), 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(LOCAL_TTS_SAMPLE_RATE)
+            wav.writeframes(self._render(clean_text, voice_config))
+        temp_filepath.replace(filepath)
+        self.cache.add(filename, voice_config)
+        return filename
+
+    def _generate_audio_url(self, text, speaker_id):
+        # generate_audio_async has already looked the clip up in the cache
+        filename = self._generate_audio_file(text, speaker_id, check_cache=False)
+        if filename:
+            return f"/static/audio/{filename}"
+        return None
+
+    def generate_audio_async(self, text, speaker_id, timeout=None):
+        """
+        Queue audio generation for async processing.
+        Returns a concurrent.futures.Future that resolves to the audio URL (None on failure).
+        Cached clips resolve immediately; otherwise this blocks while the generation queue is full.
+        """
+        filename = self._get_audio_filename(text, speaker_id)
+        if self.cache.lookup(filename):
+            future = Future()
+            future.set_result(f"/static/audio/{filename}")
+            return future
+        return self.pool.submit(text, speaker_id, timeout=timeout)
+
+    def stats(self):
+        return {"pool": self.pool.stats(), "cache": self.cache.stats()}
+
+    def generate_audio(self, text, speaker_id):
+        """Generate audio synchronously and return filename."""
+        return self._generate_audio_file(text, speaker_id)
+
+    def get_audio_url(self, text, speaker_id):
+        """Get the URL for the audio file (generate if needed)."""
+        filename = self._generate_audio_file(text, speaker_id)
+        if filename:
+            return f"/static/audio/{filename}"
+        return None
@@ -5,8 +5,8 @@
 MAX_TURNS = 18
 CLEAR_CACHE = False          # WARNING: This clears the entire cache, not just this use case
 CACHE_RESULT = True
-USE_GOOGLE_CLOUD_TTS = True  # Text-to-speech: if both are false, no TTS is generated
-USE_GTTS = False
+TTS_BACKEND = "google"       # Text-to-speech: "google", "gtts", "local" (offline tones) or "none";
+                             # overridden by the TTS_BACKEND environment variable or --tts <name>
 ##############################
 
 
@@ -20,16 +20,17 @@ import uuid
 import json
 import logging
 import webbrowser
-import re
 import time
 import signal
 from dotenv import load_dotenv
-from app import start_flask_app, update_chat_history, update_scenario_info, is_execution_paused
+from app import start_flask_app, append_chat_message, update_chat_message, update_scenario_info, is_execution_paused, wait_while_paused
 from agent_squad.orchestrator import AgentSquad, AgentSquadConfig
 from agent_squad.types import ConversationMessage, ParticipantRole
 from agent_squad.classifiers import ClassifierResult
 from agent_chooser import AgentChooser
+from tts_backends import configure_tts_backend, get_tts_service, tts_backend_from_args, tts_enabled, warm_up_tts_service
 from agent_factory import create_agents_from_scenario
+from custom_agent import TurnResult
 
 import llm_cache
 if CLEAR_CACHE: # wipe existing cache values
@@ -47,20 +48,15 @@ logging.getLogger("werkzeug").setLevel(logging.WARNING)
 load_dotenv()
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
-# Initialize the appropriate TTS service
-if USE_GOOGLE_CLOUD_TTS:
-    from google_cloud_tts_service import GoogleCloudTTSService
-    tts_service = GoogleCloudTTSService()
-elif USE_GTTS:
-    from tts_service import TTSService
-    tts_service = TTSService()
-else:
-    tts_service = None
+# Select the TTS backend; it is imported and created when audio is first needed
+TTS_BACKEND = tts_backend_from_args(sys.argv, TTS_BACKEND)
+configure_tts_backend(TTS_BACKEND)
+print(f"Text-to-speech backend: {TTS_BACKEND}")
 
 async def main(args):
     """Main function to demonstrate secure, agent-contained tool use."""
-    start_flask_app()
-    time.sleep(1)  # Give flask time to start
+    warm_up_tts_service()  # Load the TTS backend in the background
+    start_flask_app()  # Listening once it returns
     webbrowser.open("http://127.0.0.1:5001")
     
     user_id = "user_123"
@@ -133,7 +129,7 @@ async def main(args):
         # The "next_request" variable holds the conversational message. The remainder is in the history
         classifier_result = ClassifierResult(selected_agent=responding_agent, confidence=1.0)
         if turn_count == 1:
-            response_text = responding_agent.agent_config['messageToUseWhenInitiatingConversation']
+            turn = TurnResult(responding_agent.agent_config['messageToUseWhenInitiatingConversation'])
         else:
             response = await orchestrator.agent_process_request(
                 next_request,
@@ -145,11 +141,9 @@ async def main(args):
                     "agent_config": responding_agent.agent_config
                 }
             )
-            response_text = response.output.content[0]['text']
-        #print(f"\n--- Raw response: {response_text} ---")
-        tool_calls = re.findall(r'\[TOOL_CALL\](.*?)\[/TOOL_CALL\]', response_text)
-        # remove tool calls since they are private
-        clean_content = re.sub(r'\[TOOL_CALL\].*?\[/TOOL_CALL\]', '', response_text).strip()
+            turn = responding_agent.last_turn_result or TurnResult.from_message(response.output)
+        # Tool calls are private: they are reported separately and never part of the text
+        clean_content = turn.text
         full_response = f"TURN {turn_count}: Agent {responding_agent.id} said: {clean_content}"
         print("--- FULL RESPONSE ADDED TO HISTORY: ", full_response[0:200])
         # Save message to history
@@ -164,13 +158,15 @@ async def main(args):
         )
 
         # Add tool call messages to the UI history
-        for tool_name in tool_calls:
-            ui_history.append({
+        for call in turn.tool_calls:
+            tool_message = {
                 'sending_agent_id': sending_agent_name,
                 'responding_agent_id': responding_agent_name,
                 'type': 'tool',
-                'content': f"Running tool: {tool_name}",
-            })
+                'content': f"Running tool: {call['name']}",
+            }
+            ui_history.append(tool_message)
+            append_chat_message(tool_message)
         # Add the clean conversational message to the UI history
         if clean_content:
             msg_data = {
@@ -180,51 +176,56 @@ async def main(args):
                 'content': clean_content,
             }
 
+            ui_history.append(msg_data)
+            message_index = append_chat_message(msg_data)
+
+            tts_service = get_tts_service() if tts_enabled() else None
             if tts_service is not None:
                 # Remove markdown formatting characters (# and *) for TTS
                 tts_content = clean_content.replace('#', '').replace('*', '').replace('-','')
-                speaker_num = len([m for m in ui_history if m.get('type') == 'message'])
+                speaker_num = len([m for m in ui_history if m.get('type') == 'message']) - 1
                 speaker_id = f"speaker{(speaker_num % 2) + 1}"
-                print(f"Generating audio for message {speaker_num + 1}: speaker={speaker_id}")
-                audio_url = tts_service.get_audio_url(tts_content, speaker_id)
-                if audio_url:
-                    msg_data['audio_url'] = audio_url
-                    print(f"  -> Audio generated: {audio_url}")
-                else:
-                    print(f"  -> Audio generation failed")
-            
-            ui_history.append(msg_data)
+                print(f"Queueing audio for message {speaker_num + 1}: speaker={speaker_id}")
+                # Audio is generated in the background while the next turn runs;
+                # the message gets its audio_url in the UI once it is ready
+                audio_future = tts_service.generate_audio_async(tts_content, speaker_id)
+
+                def attach_audio(done, message=msg_data, index=message_index):
+                    audio_url = done.result() if not done.cancelled() and done.exception() is None else None
+                    if audio_url:
+                        update_chat_message(index, {**message, 'audio_url': audio_url})
+                        print(f"  -> Audio generated: {audio_url}")
+                    else:
+                        print(f"  -> Audio generation failed")
+
+                audio_future.add_done_callback(attach_audio)
         
         # # Count how many audio messages we're about to send
         # audio_messages = len([m for m in ui_history if m.get('type') == 'message' and m.get('audio_url')])
         
         print(f"--- UI_HISTORY length = {len(ui_history)}")
-        update_chat_history(ui_history)
 
-        # The next request for the other agent is the raw response text
-        next_request = response_text
+        # The next request for the other agent is the response text
+        next_request = turn.text
 
-        if 'toolUse' in response_text:
-            print(f"WARNING: A TOOL USE REQUEST HAS SURFACED IN THE CONVERSATION: {response_text}")
+        if turn.leaked_tool_use:
+            print(f"WARNING: A TOOL USE REQUEST HAS SURFACED IN THE CONVERSATION: {turn.text}")
 
         #Check for the termination signal in the response text
-        if "END OF CONVERSATION" in response_text:
+        if turn.ended:
             conversation_ended = True
             print("\n--- Conversation has ended ---")
         else:
             print("\n--- END OF TURN ---")
         
         # Check pause state before continuing to next turn
-        while is_execution_paused() and not conversation_ended:
+        if is_execution_paused() and not conversation_ended:
             print("⏸ Execution paused... (waiting for play)")
-            time.sleep(0.5)
+            await wait_while_paused()
     
     if not conversation_ended:
         print("\n--- Maximum turns reached, ending conversation ---")
 
-    # Give the UI a moment to fetch the final update
-    time.sleep(3)
-
 def signal_handler(sig, frame):
     """Handle Ctrl+C gracefully"""
     print("\n\nShutting down gracefully...")
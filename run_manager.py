@@ -0,0 +1,123 @@
+"""
+Run manager for executing several scenarios side by side.
+
+Every submitted scenario becomes a run with its own run ID. The run coroutine
+builds its own agents, orchestrator, session and chat history, so runs never
+share conversational state. All runs are scheduled on one asyncio event loop
+that lives in a background thread, and a semaphore caps how many conversations
+are active at the same time; the rest wait in the queue.
+"""
+import asyncio
+import threading
+import time
+import uuid
+
+MAX_CONCURRENT_RUNS = 4  # Default number of conversations allowed to run at once
+
+
+class ScenarioRun:
+    """Bookkeeping for a single submitted scenario."""
+
+    def __init__(self, run_id, scenario_data):
+        self.run_id = run_id
+        self.scenario_data = scenario_data
+        self.status = "queued"  # queued -> running -> completed | failed
+        self.error = None
+        self.result = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def title(self):
+        scenario = self.scenario_data.get("scenario") or self.scenario_data
+        return scenario.get("title", "")
+
+    def to_dict(self):
+        return {
+            "run_id": self.run_id,
+            "title": self.title,
+            "status": self.status,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ScenarioRunManager:
+    """
+    Accepts scenario submissions from any thread and runs them concurrently on a
+    shared event loop.
+
+    Args:
+        run_coroutine: async function called as run_coroutine(scenario_data, run_id).
+        max_concurrent_runs: how many runs may execute at once.
+    """
+
+    def __init__(self, run_coroutine, max_concurrent_runs=MAX_CONCURRENT_RUNS):
+        self.run_coroutine = run_coroutine
+        self.max_concurrent_runs = max_concurrent_runs
+        self.runs = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._loop_thread = None
+        self._semaphore = None
+
+    def _ensure_loop(self):
+        """Start the shared event loop thread the first time a run is submitted."""
+        with self._lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run_loop():
+                asyncio.set_event_loop(loop)
+                # The semaphore must be created on the loop that uses it
+                self._semaphore = asyncio.Semaphore(self.max_concurrent_runs)
+                ready.set()
+                loop.run_forever()
+
+            self._loop_thread = threading.Thread(target=run_loop, name="scenario-runs", daemon=True)
+            self._loop_thread.start()
+            ready.wait()
+            self._loop = loop
+            return loop
+
+    def submit(self, scenario_data):
+        """Queue a scenario for execution and return its run ID."""
+        loop = self._ensure_loop()
+        run = ScenarioRun(uuid.uuid4().hex[:12], scenario_data)
+        with self._lock:
+            self.runs[run.run_id] = run
+        asyncio.run_coroutine_threadsafe(self._execute(run), loop)
+        return run.run_id
+
+    async def _execute(self, run):
+        async with self._semaphore:
+            run.status = "running"
+            run.started_at = time.time()
+            print(f"--- Run {run.run_id} started: {run.title} ---")
+            try:
+                run.result = await self.run_coroutine(run.scenario_data, run.run_id)
+                run.status = "completed"
+            except Exception as e:
+                print(f"Error running scenario {run.run_id}: {e}")
+                run.status = "failed"
+                run.error = str(e)
+            finally:
+                run.finished_at = time.time()
+                print(f"--- Run {run.run_id} {run.status} after {run.finished_at - run.started_at:.1f}s ---")
+
+    def get_run(self, run_id):
+        with self._lock:
+            return self.runs.get(run_id)
+
+    def list_runs(self):
+        with self._lock:
+            return [run.to_dict() for run in self.runs.values()]
+
+    def count(self, status):
+        with self._lock:
+            return sum(1 for run in self.runs.values() if run.status == status)
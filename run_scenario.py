@@ -5,43 +5,39 @@
 MAX_TURNS = 18
 CLEAR_CACHE = False          # WARNING: This clears the entire cache, not just this use case
 CACHE_RESULT = True
-USE_GOOGLE_CLOUD_TTS = True  # Text-to-speech: if both are false, no TTS is generated
-USE_GTTS = False
+TTS_BACKEND = "google"       # Text-to-speech: "google", "gtts", "local" (offline tones) or "none";
+                             # overridden by the TTS_BACKEND environment variable or --tts <name>
 SERVER_PORT = 5002           # Port for the scenario runner server
+MAX_CONCURRENT_RUNS = 4      # Server mode: scenarios allowed to run at the same time
+STREAMING = True             # Stream agent responses to the chat UI token by token
+TTS_SENTENCE_CHUNKS = True   # Synthesise messages sentence by sentence so playback can start early
+AUDIO_WAIT_TIMEOUT = 120     # Seconds a finished run waits for its remaining audio clips
 ##############################
 
 
-# IMPORTANT: Import patch first to fix top_p issue with Claude Haiku 4.5
-import anthropic_top_p_patch
+import time
+STARTUP_BEGAN = time.perf_counter()  # For the startup time report
 
+# The LLM stack (anthropic SDK patch, agent_squad, llm_cache) is imported by
+# load_llm_runtime() when the first scenario starts, not here, so the server
+# and CLI start quickly. Only light modules are imported at startup.
 import asyncio
 import os
 import sys
 import uuid
 import json
 import logging
+import threading
 import webbrowser
-import re
-import time
 import signal
-import threading
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
-from app import start_flask_app, update_chat_history, update_scenario_info, is_execution_paused
-from agent_squad.orchestrator import AgentSquad, AgentSquadConfig
-from agent_squad.types import ConversationMessage, ParticipantRole
-from agent_squad.classifiers import ClassifierResult
-from agent_chooser import AgentChooser
-from agent_factory import create_agents_from_scenario
-
-import llm_cache
-if CLEAR_CACHE: # wipe existing cache values
-    cache = llm_cache.get_cache()
-    cache.clear()
-if CACHE_RESULT:
-# Enable automatic caching for all LLM calls
-    llm_cache.enable_auto_caching()
+from app import start_flask_app, append_chat_message, update_chat_message, update_streaming_message, update_scenario_info, is_execution_paused, wait_while_paused, begin_run, finish_run, DEFAULT_RUN_ID
+from tts_backends import configure_tts_backend, get_tts_service, tts_backend_from_args, tts_enabled, tts_service_stats, warm_up_tts_service
+from run_manager import ScenarioRunManager
+from tool_surrogate_cache import get_surrogate_cache
+from tts_playlist import queue_playlist
 
 # Suppress httpx info logs
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -51,26 +47,63 @@ logging.getLogger("werkzeug").setLevel(logging.WARNING)
 load_dotenv()
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
-# Initialize the appropriate TTS service
-if USE_GOOGLE_CLOUD_TTS:
-    from google_cloud_tts_service import GoogleCloudTTSService
-    tts_service = GoogleCloudTTSService()
-elif USE_GTTS:
-    from tts_service import TTSService
-    tts_service = TTSService()
-else:
-    tts_service = None
-
-def create_agents_from_json_data(scenario_data):
+# Select the TTS backend; it is imported and created when audio is first needed
+TTS_BACKEND = tts_backend_from_args(sys.argv, TTS_BACKEND)
+configure_tts_backend(TTS_BACKEND)
+print(f"Text-to-speech backend: {TTS_BACKEND}")
+print(f"Startup: modules loaded in {time.perf_counter() - STARTUP_BEGAN:.2f}s")
+
+_llm_runtime_loaded = False
+_llm_runtime_lock = threading.Lock()
+
+def load_llm_runtime():
+    """
+    Imports the LLM and agent stack the first time a scenario needs it, and
+    sets up llm_cache. Safe to call from several threads; only the first call
+    does any work.
+    """
+    global _llm_runtime_loaded
+    with _llm_runtime_lock:
+        if _llm_runtime_loaded:
+            return
+        started = time.perf_counter()
+        # IMPORTANT: Import patch first to fix top_p issue with Claude Haiku 4.5
+        import anthropic_top_p_patch
+
+        import llm_cache
+        if CLEAR_CACHE: # wipe existing cache values
+            cache = llm_cache.get_cache()
+            cache.clear()
+        if CACHE_RESULT:
+        # Enable automatic caching for all LLM calls
+            llm_cache.enable_auto_caching()
+
+        # Load the agent modules now, so the imports in the functions below are free
+        import agent_squad.orchestrator
+        import agent_factory
+        import custom_agent
+        _llm_runtime_loaded = True
+        print(f"LLM runtime loaded in {time.perf_counter() - started:.2f}s")
+
+def surrogate_engine_stats():
+    """Stats of the tool surrogate engine, or None before the LLM runtime is loaded."""
+    if not _llm_runtime_loaded:
+        return None
+    from tool_surrogate_engine import get_surrogate_engine
+    return get_surrogate_engine().stats()
+
+
+def create_agents_from_json_data(scenario_data, streaming=STREAMING):
     """
     Creates agents from in-memory JSON data instead of a file.
     This is used when the scenario is submitted via the API.
     """
+    load_llm_runtime()
     from custom_agent import CustomAnthropicAgent
     from agent_squad.agents import AnthropicAgentOptions
     from agent_squad.utils import AgentTool, AgentTools
     import local_tools as local_tools
-    from custom_agent import mcp_tool_func, tool_surrogate_func
+    from custom_agent import mcp_tool_func, tool_surrogate_func, MAX_PARALLEL_TOOL_CALLS
     from main_prompt_builder import build_main_prompt
     import inspect
     
@@ -120,41 +153,123 @@ def create_agents_from_json_data(scenario_data):
             description=agent_config.get('situation'),
             api_key=ANTHROPIC_API_KEY,
             model_id='claude-haiku-4-5-20251001',
-            streaming=False,
+            streaming=streaming,
             custom_system_prompt={"template": system_prompt},
-            tool_config={'tool': tools, 'toolMaxRecursions': 10}
+            tool_config={'tool': tools, 'toolMaxRecursions': 10, 'toolMaxParallelCalls': MAX_PARALLEL_TOOL_CALLS}
         ))
         agent.agent_config = agent_config
+        # Render the static parts of the tool surrogate prompts once per run
+        agent.compile_prompts(scenario_data)
         agents.append(agent)
 
     return scenario_data, agents
 
 
-async def run_scenario_from_data(scenario_data):
-    """Run a scenario from in-memory JSON data."""
-    start_flask_app()
-    time.sleep(1)  # Give flask time to start
-    webbrowser.open_new("http://127.0.0.1:5001")
-    
-    user_id = "user_123"
-    session_id = str(uuid.uuid4())
-
-    _, agents = create_agents_from_json_data(scenario_data)
-    if not agents:
-        print("No agents were created. Exiting.")
-        return False
-
-    # Update scenario info for the UI
+def update_scenario_info_from_data(scenario_data, run_id=DEFAULT_RUN_ID):
+    """Update scenario info for the UI - handle both nested and flat structures"""
     if scenario_data.get("scenario") and scenario_data["scenario"].get("title"):
         update_scenario_info({
             "title": scenario_data["scenario"].get("title", ""),
             "description": scenario_data["scenario"].get("description", "")
-        })
+        }, run_id)
     elif scenario_data.get("title"):
         update_scenario_info({
             "title": scenario_data.get("title", ""),
             "description": scenario_data.get("description", "")
-        })
+        }, run_id)
+
+
+async def start_ui(run_id=DEFAULT_RUN_ID):
+    """Start the chat UI (once per process) and open a browser window on this run."""
+    # Runs with a UI will need audio: load the TTS backend while the first turn starts
+    warm_up_tts_service()
+    start_flask_app()  # Listening once it returns
+    url = "http://127.0.0.1:5001"
+    if run_id != DEFAULT_RUN_ID:
+        url = f"{url}/?run_id={run_id}"
+    webbrowser.open_new(url)
+
+
+async def queue_message_audio(message, index, speaker_id, run_id=DEFAULT_RUN_ID):
+    """
+    Starts generating the audio of a published UI message in the background.
+    The UI message gets its audio when it is ready, so TTS runs alongside the
+    next turn instead of holding it up. With TTS_SENTENCE_CHUNKS the message
+    gets an audio_playlist that grows sentence by sentence; otherwise a single
+    audio_url. Returns the Futures of the clips.
+    """
+    # Remove markdown formatting characters (# and *) for TTS
+    tts_content = message['content'].replace('#', '').replace('*', '').replace('-','')
+    # The backend is created on first use, which can take a moment (e.g. the gRPC client)
+    tts_service = await asyncio.to_thread(get_tts_service)
+    if tts_service is None:
+        return []
+
+    if TTS_SENTENCE_CHUNKS:
+        def attach_playlist(urls, complete):
+            if urls:
+                update_chat_message(index, {**message, 'audio_playlist': urls, 'audio_complete': complete}, run_id)
+            if complete:
+                print(f"  -> Audio generated: {len(urls)} clips for message {index}")
+
+        # Queueing blocks while the TTS queue is full; wait in a thread so other runs keep going
+        return await asyncio.to_thread(queue_playlist, tts_service, tts_content, speaker_id, attach_playlist)
+
+    future = await asyncio.to_thread(tts_service.generate_audio_async, tts_content, speaker_id)
+
+    def attach_audio(done):
+        audio_url = done.result() if not done.cancelled() and done.exception() is None else None
+        if audio_url:
+            update_chat_message(index, {**message, 'audio_url': audio_url}, run_id)
+            print(f"  -> Audio generated: {audio_url}")
+        else:
+            print(f"  -> Audio generation failed")
+
+    future.add_done_callback(attach_audio)
+    return [future]
+
+
+async def collect_streamed_response(stream, message_data, run_id=DEFAULT_RUN_ID, headless=False):
+    """
+    Consumes a streamed agent response, publishing the partial text to the chat
+    UI as tokens arrive. Returns the text of the final message.
+    """
+    text_chunks = []
+    final_message = None
+    async for chunk in stream:
+        if chunk.final_message:
+            final_message = chunk.final_message
+        elif chunk.text:
+            text_chunks.append(chunk.text)
+            if not headless:
+                update_streaming_message({**message_data, 'content': "".join(text_chunks)}, run_id)
+    if final_message is None or not final_message.content:
+        return "".join(text_chunks)
+    return final_message.content[0].get('text', '')
+
+
+async def run_conversation(scenario_data, agents, run_id=DEFAULT_RUN_ID, headless=False):
+    """
+    Runs the turn loop for one scenario.
+    Each call gets its own session, orchestrator and UI history, so several
+    conversations can run side by side on the same event loop.
+    In headless mode nothing is sent to the chat UI and no audio is generated.
+
+    Returns a dict with the turn count, tool call count, whether the conversation
+    ended by itself, the token usage of the agents and the UI transcript, or
+    False if the conversation could not be started.
+    """
+    from agent_squad.orchestrator import AgentSquad, AgentSquadConfig
+    from agent_squad.types import ConversationMessage, ParticipantRole
+    from agent_squad.classifiers import ClassifierResult
+    from agent_chooser import AgentChooser
+    from custom_agent import TurnResult
+
+    user_id = "user_123"
+    session_id = str(uuid.uuid4())
+
+    if not headless:
+        update_scenario_info_from_data(scenario_data, run_id)
 
     # Set up the orchestrator
     sending_agent = next((agent for agent in agents if 'messageToUseWhenInitiatingConversation' in agent.agent_config), None)
@@ -183,10 +298,23 @@ async def run_scenario_from_data(scenario_data):
     conversation_ended = False
     next_request = None
     ui_history = []
+    tool_call_count = 0
+
+    audio_futures = []
+
+    def publish(message):
+        """
+        Add a message to the transcript and, unless headless, to the chat UI.
+        Returns the message's index in the chat UI (None when headless).
+        """
+        ui_history.append(message)
+        if not headless:
+            return append_chat_message(message, run_id)
+        return None
     
     while not conversation_ended and turn_count < max_turns:
         turn_count += 1
-        print(f"\n======= Turn {turn_count} =======")
+        print(f"\n======= [{run_id}] Turn {turn_count} =======")
         # swap agent roles
         temp = responding_agent
         temp_name = responding_agent_name
@@ -194,12 +322,14 @@ async def run_scenario_from_data(scenario_data):
         responding_agent_name = sending_agent_name
         sending_agent = temp
         sending_agent_name = temp_name
+        # end swap roles
 
         print(f"--- Sending agent: {sending_agent.id}, Responding agent: {responding_agent.id} ---")
 
+        # The "next_request" variable holds the conversational message. The remainder is in the history
         classifier_result = ClassifierResult(selected_agent=responding_agent, confidence=1.0)
         if turn_count == 1:
-            response_text = responding_agent.agent_config['messageToUseWhenInitiatingConversation']
+            turn = TurnResult(responding_agent.agent_config['messageToUseWhenInitiatingConversation'])
         else:
             response = await orchestrator.agent_process_request(
                 next_request,
@@ -209,15 +339,22 @@ async def run_scenario_from_data(scenario_data):
                 additional_params={
                     "scenario": orchestrator.scenario_data,
                     "agent_config": responding_agent.agent_config
-                }
+                },
+                stream_response=responding_agent.is_streaming_enabled()
             )
-            response_text = response.output.content[0]['text']
-        
-        tool_calls = re.findall(r'\[TOOL_CALL\](.*?)\[/TOOL_CALL\]', response_text)
-        clean_content = re.sub(r'\[TOOL_CALL\].*?\[/TOOL_CALL\]', '', response_text).strip()
+            if response.streaming:
+                await collect_streamed_response(response.output, {
+                    'sending_agent_id': sending_agent_name,
+                    'responding_agent_id': responding_agent_name,
+                    'type': 'message',
+                }, run_id, headless)
+            # Built by the agent in one pass once the response was complete
+            turn = responding_agent.last_turn_result or TurnResult.from_message(response.output)
+        # Tool calls are private: they are reported separately and never part of the text
+        clean_content = turn.text
         full_response = f"TURN {turn_count}: Agent {responding_agent.id} said: {clean_content}"
         print("--- FULL RESPONSE ADDED TO HISTORY: ", full_response[0:200])
-        
+        # Save message to history
         await orchestrator.storage.save_chat_message(
             user_id,
             session_id,
@@ -228,14 +365,18 @@ async def run_scenario_from_data(scenario_data):
             )
         )
 
-        for tool_name in tool_calls:
-            ui_history.append({
+        # Add tool call messages to the UI history
+        tool_call_count += len(turn.tool_calls)
+        for call in turn.tool_calls:
+            if call["seconds"] is not None:
+                print(f"--- Tool {call['name']} took {call['seconds']:.2f}s{' (cached)' if call['cached'] else ''} ---")
+            publish({
                 'sending_agent_id': sending_agent_name,
                 'responding_agent_id': responding_agent_name,
                 'type': 'tool',
-                'content': f"Running tool: {tool_name}",
+                'content': f"Running tool: {call['name']}",
             })
-        
+        # Add the clean conversational message to the UI history
         if clean_content:
             msg_data = {
                 'sending_agent_id': sending_agent_name,
@@ -244,52 +385,97 @@ async def run_scenario_from_data(scenario_data):
                 'content': clean_content,
             }
 
-            if tts_service is not None:
-                tts_content = clean_content.replace('#', '').replace('*', '').replace('-','')
-                speaker_num = len([m for m in ui_history if m.get('type') == 'message'])
+            message_index = publish(msg_data)
+
+            if tts_enabled() and not headless:
+                speaker_num = len([m for m in ui_history if m.get('type') == 'message']) - 1
                 speaker_id = f"speaker{(speaker_num % 2) + 1}"
-                print(f"Generating audio for message {speaker_num + 1}: speaker={speaker_id}")
-                audio_url = tts_service.get_audio_url(tts_content, speaker_id)
-                if audio_url:
-                    msg_data['audio_url'] = audio_url
-                    print(f"  -> Audio generated: {audio_url}")
-                else:
-                    print(f"  -> Audio generation failed")
-            
-            ui_history.append(msg_data)
+                print(f"Queueing audio for message {speaker_num + 1}: speaker={speaker_id}")
+                audio_futures.extend(await queue_message_audio(msg_data, message_index, speaker_id, run_id))
         
         print(f"--- UI_HISTORY length = {len(ui_history)}")
-        update_chat_history(ui_history)
-        next_request = response_text
+        if not headless:
+            update_streaming_message(None, run_id)
+
+        # The next request for the other agent is the response text
+        next_request = turn.text
 
-        if 'toolUse' in response_text:
-            print(f"WARNING: A TOOL USE REQUEST HAS SURFACED IN THE CONVERSATION: {response_text}")
+        if turn.leaked_tool_use:
+            print(f"WARNING: A TOOL USE REQUEST HAS SURFACED IN THE CONVERSATION: {turn.text}")
 
-        if "END OF CONVERSATION" in response_text:
+        #Check for the termination signal in the response text
+        if turn.ended:
             conversation_ended = True
             print("\n--- Conversation has ended ---")
         else:
             print("\n--- END OF TURN ---")
         
-        while is_execution_paused() and not conversation_ended:
-            print("⏸ Execution paused... (waiting for play)")
-            time.sleep(0.5)
+        # Check pause state before continuing to next turn
+        if not headless and is_execution_paused(run_id) and not conversation_ended:
+            print(f"⏸ Execution of run {run_id} paused... (waiting for play)")
+            await wait_while_paused(run_id)
     
     if not conversation_ended:
         print("\n--- Maximum turns reached, ending conversation ---")
 
-    time.sleep(3)
-    return True
+    if audio_futures:
+        # Let the last messages get their audio before the run is reported as done,
+        # but not forever: a hung TTS call must not keep the run (and its slot) open
+        _, pending = await asyncio.wait([asyncio.wrap_future(future) for future in audio_futures],
+                                        timeout=AUDIO_WAIT_TIMEOUT)
+        if pending:
+            print(f"WARNING: {len(pending)} audio clips of run {run_id} not ready after {AUDIO_WAIT_TIMEOUT}s; cancelling them")
+            for future in audio_futures:
+                # Clips still queued are skipped by the workers; one already being generated finishes on its own
+                future.cancel()
+    # No need to wait for the UI: the history stays on the server and /events pushes the last update
+
+    tokens = {"input_tokens": 0, "output_tokens": 0, "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+    for agent in agents:
+        for key in tokens:
+            tokens[key] += agent.token_usage[key]
+    return {
+        "turns": turn_count,
+        "tool_calls": tool_call_count,
+        "ended": conversation_ended,
+        "tokens": tokens,
+        "transcript": ui_history,
+    }
+
+
+async def run_scenario_from_data(scenario_data, run_id=DEFAULT_RUN_ID):
+    """Run a scenario from in-memory JSON data."""
+    begin_run(run_id)
+    try:
+        await start_ui(run_id)
+        # The first run imports the LLM stack; do that off the shared event loop
+        await asyncio.to_thread(load_llm_runtime)
+
+        _, agents = create_agents_from_json_data(scenario_data)
+        if not agents:
+            print("No agents were created. Exiting.")
+            return False
+
+        return await run_conversation(scenario_data, agents, run_id)
+    finally:
+        # The chat stays available for RUN_RETENTION_SECONDS, then its state is dropped
+        finish_run(run_id)
+
+
+async def run_scenario_headless(scenario_data, run_id=DEFAULT_RUN_ID):
+    """Run a scenario without the chat UI, the browser or TTS (used by batch mode)."""
+    await asyncio.to_thread(load_llm_runtime)
+    _, agents = create_agents_from_json_data(scenario_data)
+    if not agents:
+        print("No agents were created. Exiting.")
+        return False
+
+    return await run_conversation(scenario_data, agents, run_id, headless=True)
 
 
 async def main(args):
     """Main function to demonstrate secure, agent-contained tool use."""
-    start_flask_app()
-    time.sleep(1)  # Give flask time to start
-    webbrowser.open_new("http://127.0.0.1:5001")
-    
-    user_id = "user_123"
-    session_id = str(uuid.uuid4())
+    await start_ui()
 
     if len(args) != 2:
         print("You must pass in the name of the scenario as the command line argument")
@@ -302,159 +488,14 @@ async def main(args):
             scenario_path_json = scenario_path
             scenario_path = scenario_path.replace(".json", "")
     scenario_path_text = f'{scenario_path}_result.txt'
-    scenario_data, agents = create_agents_from_scenario(scenario_path_json)
+    load_llm_runtime()
+    from agent_factory import create_agents_from_scenario
+    scenario_data, agents = create_agents_from_scenario(scenario_path_json, streaming=STREAMING)
     if not agents:
         print("No agents were created. Exiting.")
         return
 
-    # Update scenario info for the UI - handle both nested and flat structures
-    if scenario_data.get("scenario"):
-        update_scenario_info({
-            "title": scenario_data["scenario"].get("title", ""),
-            "description": scenario_data["scenario"].get("description", "")
-        })
-    elif scenario_data.get("title"):
-        update_scenario_info({
-            "title": scenario_data.get("title", ""),
-            "description": scenario_data.get("description", "")
-        })
-
-    # 2. Set up the orchestrator
-    sending_agent = next((agent for agent in agents if 'messageToUseWhenInitiatingConversation' in agent.agent_config), None)
-    if not sending_agent:
-        print("Could not find an initiating agent in the scenario. You must specify an initiating message.")
-        return
-    else:
-        sending_agent_name = sending_agent.agent_config.get('agentName', sending_agent.id)
-    responding_agent = next((agent for agent in agents if agent.id != sending_agent.id), None)
-    responding_agent_name = responding_agent.agent_config.get('agentName', responding_agent.id) if responding_agent else "Unknown"
-    
-    classifier = AgentChooser(initiating_agent_id=responding_agent.id)
-    orchestrator = AgentSquad(
-        classifier=classifier,
-        options=AgentSquadConfig(
-            LOG_CLASSIFIER_OUTPUT=False
-        )
-    )
-    orchestrator.scenario_data = scenario_data
-    for agent in agents:
-        orchestrator.add_agent(agent)
-
-    # 3. Main conversational loop
-    max_turns = MAX_TURNS
-    turn_count = 0
-    conversation_ended = False
-    next_request = None
-    ui_history = []
-    
-    while not conversation_ended and turn_count < max_turns:
-        turn_count += 1
-        print(f"\n======= Turn {turn_count} =======")
-        # swap agent roles
-        temp = responding_agent
-        temp_name = responding_agent_name
-        responding_agent = sending_agent
-        responding_agent_name = sending_agent_name
-        sending_agent = temp
-        sending_agent_name = temp_name
-        # end swap roles
-
-        print(f"--- Sending agent: {sending_agent.id}, Responding agent: {responding_agent.id} ---")
-
-        # The "next_request" variable holds the conversational message. The remainder is in the history
-        classifier_result = ClassifierResult(selected_agent=responding_agent, confidence=1.0)
-        if turn_count == 1:
-            response_text = responding_agent.agent_config['messageToUseWhenInitiatingConversation']
-        else:
-            response = await orchestrator.agent_process_request(
-                next_request,
-                user_id,
-                session_id,
-                classifier_result,
-                additional_params={
-                    "scenario": orchestrator.scenario_data,
-                    "agent_config": responding_agent.agent_config
-                }
-            )
-            response_text = response.output.content[0]['text']
-        #print(f"\n--- Raw response: {response_text} ---")
-        tool_calls = re.findall(r'\[TOOL_CALL\](.*?)\[/TOOL_CALL\]', response_text)
-        # remove tool calls since they are private
-        clean_content = re.sub(r'\[TOOL_CALL\].*?\[/TOOL_CALL\]', '', response_text).strip()
-        full_response = f"TURN {turn_count}: Agent {responding_agent.id} said: {clean_content}"
-        print("--- FULL RESPONSE ADDED TO HISTORY: ", full_response[0:200])
-        # Save message to history
-        await orchestrator.storage.save_chat_message(
-            user_id,
-            session_id,
-            responding_agent.id,
-            ConversationMessage(
-                role=ParticipantRole.ASSISTANT.value,
-                content=[{'text': full_response}]
-            )
-        )
-
-        # Add tool call messages to the UI history
-        for tool_name in tool_calls:
-            ui_history.append({
-                'sending_agent_id': sending_agent_name,
-                'responding_agent_id': responding_agent_name,
-                'type': 'tool',
-                'content': f"Running tool: {tool_name}",
-            })
-        # Add the clean conversational message to the UI history
-        if clean_content:
-            msg_data = {
-                'sending_agent_id': sending_agent_name,
-                'responding_agent_id': responding_agent_name,
-                'type': 'message',
-                'content': clean_content,
-            }
-
-            if tts_service is not None:
-                # Remove markdown formatting characters (# and *) for TTS
-                tts_content = clean_content.replace('#', '').replace('*', '').replace('-','')
-                speaker_num = len([m for m in ui_history if m.get('type') == 'message'])
-                speaker_id = f"speaker{(speaker_num % 2) + 1}"
-                print(f"Generating audio for message {speaker_num + 1}: speaker={speaker_id}")
-                audio_url = tts_service.get_audio_url(tts_content, speaker_id)
-                if audio_url:
-                    msg_data['audio_url'] = audio_url
-                    print(f"  -> Audio generated: {audio_url}")
-                else:
-                    print(f"  -> Audio generation failed")
-            
-            ui_history.append(msg_data)
-        
-        # # Count how many audio messages we're about to send
-        # audio_messages = len([m for m in ui_history if m.get('type') == 'message' and m.get('audio_url')])
-        
-        print(f"--- UI_HISTORY length = {len(ui_history)}")
-        update_chat_history(ui_history)
-
-        # The next request for the other agent is the raw response text
-        next_request = response_text
-
-        if 'toolUse' in response_text:
-            print(f"WARNING: A TOOL USE REQUEST HAS SURFACED IN THE CONVERSATION: {response_text}")
-
-        #Check for the termination signal in the response text
-        if "END OF CONVERSATION" in response_text:
-            conversation_ended = True
-            print("\n--- Conversation has ended ---")
-        else:
-            print("\n--- END OF TURN ---")
-        
-        # Check pause state before continuing to next turn
-        while is_execution_paused() and not conversation_ended:
-            print("⏸ Execution paused... (waiting for play)")
-            time.sleep(0.5)
-    
-    if not conversation_ended:
-        print("\n--- Maximum turns reached, ending conversation ---")
-
-    # Give the UI a moment to fetch the final update
-    time.sleep(3)
+    await run_conversation(scenario_data, agents)
 
 def signal_handler(sig, frame):
     """Handle Ctrl+C gracefully"""
@@ -470,31 +511,19 @@ def signal_handler(sig, frame):
 server_app = Flask(__name__)
 CORS(server_app)  # Enable CORS for cross-origin requests from the editor
 
-# Track if a scenario is currently running
-scenario_running = False
-scenario_lock = threading.Lock()
+# Runs submitted from the editor execute side by side on one shared event loop
+run_manager = ScenarioRunManager(run_scenario_from_data, max_concurrent_runs=MAX_CONCURRENT_RUNS)
 
 @server_app.route('/run-scenario', methods=['POST'])
 def api_run_scenario():
     """API endpoint to run a scenario from JSON data."""
-    global scenario_running
-    
-    with scenario_lock:
-        if scenario_running:
-            return jsonify({"error": "A scenario is already running"}), 409
-        scenario_running = True
-    
     try:
         scenario_data = request.get_json()
         if not scenario_data:
-            with scenario_lock:
-                scenario_running = False
             return jsonify({"error": "No JSON data provided"}), 400
         
         # Validate required fields
         if 'agents' not in scenario_data or len(scenario_data.get('agents', [])) < 2:
-            with scenario_lock:
-                scenario_running = False
             return jsonify({"error": "Scenario must have at least 2 agents"}), 400
         
         # Check that at least one agent has the initiating message
@@ -503,46 +532,82 @@ def api_run_scenario():
             for agent in scenario_data.get('agents', [])
         )
         if not has_initiating_message:
-            with scenario_lock:
-                scenario_running = False
             return jsonify({"error": "At least one agent must have 'messageToUseWhenInitiatingConversation'"}), 400
         
-        # Run the scenario in a background thread
-        def run_in_background():
-            global scenario_running
-            try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(run_scenario_from_data(scenario_data))
-            except Exception as e:
-                print(f"Error running scenario: {e}")
-            finally:
-                with scenario_lock:
-                    scenario_running = False
-        
-        thread = threading.Thread(target=run_in_background)
-        thread.daemon = True
-        thread.start()
-        
+        run_id = run_manager.submit(scenario_data)
         return jsonify({
             "status": "started",
-            "message": "Scenario is now running. Check the chat window at http://127.0.0.1:5001"
+            "run_id": run_id,
+            "message": f"Scenario is now running. Check the chat window at http://127.0.0.1:5001/?run_id={run_id}"
         })
         
     except Exception as e:
-        with scenario_lock:
-            scenario_running = False
         return jsonify({"error": str(e)}), 500
 
 
 @server_app.route('/status', methods=['GET'])
 def api_status():
-    """Check if the server is running and if a scenario is active."""
-    with scenario_lock:
-        return jsonify({
-            "status": "running",
-            "scenario_active": scenario_running
-        })
+    """Check if the server is running and how many scenarios are active."""
+    running = run_manager.count("running")
+    return jsonify({
+        "status": "running",
+        "scenario_active": running > 0,
+        "running_runs": running,
+        "queued_runs": run_manager.count("queued"),
+        "max_concurrent_runs": run_manager.max_concurrent_runs,
+        "surrogate_engine": surrogate_engine_stats(),
+        "surrogate_cache": get_surrogate_cache().stats() if get_surrogate_cache() else None,
+        "tts": tts_service_stats()
+    })
+
+
+@server_app.route('/runs', methods=['GET'])
+def api_list_runs():
+    """List every run submitted to this server."""
+    return jsonify(run_manager.list_runs())
+
+
+@server_app.route('/runs/<run_id>', methods=['GET'])
+def api_get_run(run_id):
+    """Status of a single run."""
+    run = run_manager.get_run(run_id)
+    if run is None:
+        return jsonify({"error": f"Unknown run '{run_id}'"}), 404
+    return jsonify(run.to_dict())
+
+
+def profile_startup(top=20):
+    """
+    Prints the slowest imports of this module, measured with python -X importtime
+    in a fresh interpreter, then the same for the LLM runtime that is loaded when
+    the first scenario starts.
+    """
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    stages = [
+        ("startup (import run_scenario)", "import run_scenario"),
+        ("first scenario (load_llm_runtime)", "import run_scenario; run_scenario.load_llm_runtime()"),
+    ]
+    for label, code in stages:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=here, capture_output=True, text=True
+        )
+        imports = []
+        for line in result.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+            imports.append((int(cumulative_us), int(self_us), name.rstrip()))
+        print("="*60)
+        print(f"{label}: {sum(entry[1] for entry in imports) / 1e6:.2f}s in {len(imports)} imports")
+        if result.returncode != 0:
+            print(f"(exited with code {result.returncode}: {result.stderr.strip().splitlines()[-1]})")
+        print(f"{'cumulative':>12} {'self':>10}  module")
+        for cumulative_us, self_us, name in sorted(imports, key=lambda entry: entry[0], reverse=True)[:top]:
+            print(f"{cumulative_us / 1000:>10.1f}ms {self_us / 1000:>8.1f}ms  {name}")
+    print("="*60)
 
 
 def run_server():
@@ -550,11 +615,14 @@ def run_server():
     print("="*60)
     print("SCENARIO RUNNER SERVER")
     print("="*60)
-    print(f"Server running on http://127.0.0.1:{SERVER_PORT}")
+    print(f"Server running on http://127.0.0.1:{SERVER_PORT} (started in {time.perf_counter() - STARTUP_BEGAN:.2f}s)")
+    print(f"Up to {MAX_CONCURRENT_RUNS} scenarios run at the same time.")
     print("Waiting for scenarios from the editor...")
     print("Press Ctrl+C to stop the server.")
     print("="*60 + "\n")
     
+    # Load the LLM stack in the background so the first scenario does not wait for it
+    threading.Thread(target=load_llm_runtime, name="llm-runtime-warm-up", daemon=True).start()
     server_app.run(port=SERVER_PORT, use_reloader=False, threaded=True)
 
 
@@ -565,6 +633,22 @@ if __name__ == "__main__":
     # Check for --server flag to run in server mode
     if len(sys.argv) >= 2 and sys.argv[1] == '--server':
         run_server()
+    elif len(sys.argv) >= 2 and sys.argv[1] == '--profile-startup':
+        # Which imports make startup slow: python run_scenario.py --profile-startup
+        profile_startup()
+    elif len(sys.argv) >= 2 and sys.argv[1] == '--batch':
+        # Headless batch mode: python run_scenario.py --batch scenarios/ [--workers N] [--out DIR]
+        import argparse
+        from batch_runner import run_batch, BATCH_WORKERS, BATCH_OUTPUT_DIR
+        parser = argparse.ArgumentParser(prog="run_scenario.py --batch")
+        parser.add_argument('targets', nargs='+', help="Scenario directories or glob patterns")
+        parser.add_argument('--workers', type=int, default=BATCH_WORKERS, help="Scenarios to run at the same time")
+        parser.add_argument('--out', default=BATCH_OUTPUT_DIR, help="Directory for transcripts and the summary")
+        batch_args = parser.parse_args(sys.argv[2:])
+        asyncio.run(run_batch(batch_args.targets, run_scenario_headless, batch_args.workers, batch_args.out))
+        print(f"Tool surrogate engine: {surrogate_engine_stats()}")
+        if get_surrogate_cache():
+            print(f"Tool surrogate cache: {get_surrogate_cache().stats()}")
     else:
         # Original CLI mode
         asyncio.run(main(sys.argv))
@@ -0,0 +1,39 @@
+"""Regression checks for TurnResult: replies arrive as dict blocks (streamed) or SDK objects (single responses)."""
+from anthropic.types import Message, TextBlock, ToolUseBlock, Usage
+from agent_squad.types import ConversationMessage
+
+from custom_agent import TurnResult
+
+
+def test_dict_content():
+    message = ConversationMessage(role="assistant", content=[{"text": "Thanks, goodbye. END OF CONVERSATION"}])
+    turn = TurnResult.from_message(message, [{"name": "lookup", "seconds": 0.2, "cached": False}])
+    assert turn.text == "Thanks, goodbye. END OF CONVERSATION"
+    assert turn.ended
+    assert turn.tool_calls[0]["name"] == "lookup"
+
+
+def test_sdk_object_content():
+    message = Message(
+        id="msg_1", type="message", role="assistant", model="claude-haiku-4-5-20251001",
+        stop_reason="end_turn", stop_sequence=None, usage=Usage(input_tokens=1, output_tokens=1),
+        content=[
+            TextBlock(type="text", text="All done. "),
+            ToolUseBlock(type="tool_use", id="toolu_1", name="lookup", input={}),
+            TextBlock(type="text", text="END OF CONVERSATION"),
+        ],
+    )
+    turn = TurnResult.from_message(message)
+    assert turn.text == "All done. END OF CONVERSATION"
+    assert turn.ended
+    assert not turn.leaked_tool_use
+
+
+def test_non_text_dict_blocks_are_skipped():
+    message = ConversationMessage(role="assistant", content=[
+        {"type": "tool_use", "id": "toolu_1", "name": "lookup", "input": {}},
+        {"type": "text", "text": "Still talking."},
+    ])
+    turn = TurnResult.from_message(message)
+    assert turn.text == "Still talking."
+    assert not turn.ended
@@ -0,0 +1,135 @@
+"""
+Deterministic cache for tool surrogate results.
+
+The same tool is often called with identical arguments in the same scenario
+(reruns, retries, both agents asking for the same record). This cache returns
+the earlier simulated result instead of building the surrogate prompt and
+asking the LLM again, which also keeps tool outputs stable while the
+conversation around them varies.
+
+Entries are keyed on scenario id, agent id, tool name and the canonicalised
+arguments, plus a digest of the scenario body and the agent configuration
+(knowledge base, tool definitions, prompt): variants of a scenario that share
+an id but differ in content never see each other's results. The conversation history is either left out of the key ("exclude",
+the default) or folded in as a hash ("hash"), in which case a result is only
+reused for the exact same conversation. Entries expire after a TTL and the
+least recently used entries are evicted once the cache is full.
+
+This is separate from llm_cache's automatic caching, which keys on the whole
+LLM request and therefore misses whenever the conversation changes.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+SURROGATE_CACHE_ENABLED = True
+SURROGATE_CACHE_MAX_ENTRIES = 1000
+SURROGATE_CACHE_TTL = 24 * 60 * 60      # Seconds; None keeps entries until they are evicted
+SURROGATE_CACHE_HISTORY_MODE = "exclude"  # "exclude" or "hash"
+
+
+def _canonical_json(data):
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def _history_digest(chat_history):
+    digest = hashlib.sha256()
+    for message in chat_history or []:
+        text = ""
+        if message.content and isinstance(message.content, list) and 'text' in message.content[0]:
+            text = message.content[0]['text']
+        digest.update(f"{message.role}:{text}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def content_digest(scenario, agent_config):
+    """Hash of the scenario body and the agent configuration; computed once per scenario load."""
+    return hashlib.sha256(_canonical_json([scenario, agent_config]).encode("utf-8")).hexdigest()
+
+
+class SurrogateResultCache:
+    def __init__(self, max_entries=SURROGATE_CACHE_MAX_ENTRIES, ttl=SURROGATE_CACHE_TTL,
+                 history_mode=SURROGATE_CACHE_HISTORY_MODE):
+        if history_mode not in ("exclude", "hash"):
+            raise ValueError(f"history_mode must be 'exclude' or 'hash', not '{history_mode}'")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.history_mode = history_mode
+        self._entries = OrderedDict()  # key -> (stored_at, result), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def make_key(self, scenario, agent_config, tool_name, args, chat_history=None, content=None):
+        """content is content_digest(scenario, agent_config), computed here if not given."""
+        scenario_id = (scenario.get('scenario') or {}).get('id') or scenario.get('id')
+        key_parts = {
+            "scenario": scenario_id,
+            "agent": agent_config.get('agentId'),
+            "tool": tool_name,
+            "content": content or content_digest(scenario, agent_config),
+            "args": {name: value for name, value in args.items() if name != 'tool_name'},
+        }
+        if self.history_mode == "hash":
+            key_parts["history"] = _history_digest(chat_history)
+        return hashlib.sha256(_canonical_json(key_parts).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Returns the cached result, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, result = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = (time.time(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "history_mode": self.history_mode,
+            }
+
+
+# Global surrogate result cache (None when caching is disabled)
+_surrogate_cache = None
+_surrogate_cache_lock = threading.Lock()
+
+def get_surrogate_cache():
+    global _surrogate_cache
+    if not SURROGATE_CACHE_ENABLED:
+        return None
+    with _surrogate_cache_lock:
+        if _surrogate_cache is None:
+            _surrogate_cache = SurrogateResultCache()
+        return _surrogate_cache
@@ -0,0 +1,114 @@
+"""
+Shared, long-lived engine for tool surrogate LLM calls.
+
+Every simulated tool call used to build a new AnthropicAgent, and with it a new
+Anthropic SDK client and HTTP connection pool, so each call paid for client
+setup and a fresh TLS handshake. The engine keeps one async client with a
+keep-alive connection pool and reuses it for all tool calls, agents and
+sessions in the process.
+
+httpx pools are bound to the event loop they were first used on, so the engine
+keeps one client per running loop (normally there is only one). The number of
+TCP connections actually opened is counted through the httpcore trace hook, so
+reuse can be verified: with keep-alive working it stays close to the pool size
+no matter how many tool calls are made.
+"""
+import asyncio
+import os
+import threading
+import weakref
+import httpx
+from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+from dotenv import load_dotenv
+
+SURROGATE_MODEL_ID = 'claude-haiku-4-5-20251001'
+SURROGATE_MAX_TOKENS = 1000
+SURROGATE_TEMPERATURE = 0.1
+SURROGATE_MAX_CONNECTIONS = 20            # Upper bound on simultaneous connections to the API
+SURROGATE_MAX_KEEPALIVE_CONNECTIONS = 10  # Idle connections kept open for reuse
+SURROGATE_KEEPALIVE_EXPIRY = 60.0         # Seconds an idle connection is kept
+
+load_dotenv()
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+
+
+class SurrogateEngine:
+    def __init__(
+        self,
+        api_key=None,
+        model_id=SURROGATE_MODEL_ID,
+        max_connections=SURROGATE_MAX_CONNECTIONS,
+        max_keepalive_connections=SURROGATE_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=SURROGATE_KEEPALIVE_EXPIRY,
+    ):
+        self.api_key = api_key or ANTHROPIC_API_KEY
+        self.model_id = model_id
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._clients = weakref.WeakKeyDictionary()  # event loop -> AsyncAnthropic
+        self._lock = threading.Lock()
+        self.clients_created = 0
+        self.connections_opened = 0
+        self.requests_sent = 0
+
+    async def _trace(self, event_name, info):
+        """httpcore trace hook: called for every connection/request lifecycle event."""
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    async def _on_request(self, request):
+        self.requests_sent += 1
+        request.extensions["trace"] = self._trace
+
+    def _get_client(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.get(loop)
+            if client is None:
+                http_client = DefaultAsyncHttpxClient(
+                    limits=self.limits,
+                    event_hooks={"request": [self._on_request]},
+                )
+                client = AsyncAnthropic(api_key=self.api_key, http_client=http_client)
+                self._clients[loop] = client
+                self.clients_created += 1
+            return client
+
+    async def complete(self, prompt, max_tokens=SURROGATE_MAX_TOKENS, temperature=SURROGATE_TEMPERATURE):
+        """
+        Sends a single-turn prompt and returns (text, usage).
+        usage is a dict with input_tokens and output_tokens.
+        """
+        response = await self._get_client().messages.create(
+            model=self.model_id,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        text = "".join(block.text for block in response.content if getattr(block, "type", None) == "text")
+        usage = {"input_tokens": response.usage.input_tokens, "output_tokens": response.usage.output_tokens}
+        return text, usage
+
+    def stats(self):
+        return {
+            "clients_created": self.clients_created,
+            "connections_opened": self.connections_opened,
+            "requests_sent": self.requests_sent,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+        }
+
+
+# Global surrogate engine shared by every agent and session in the process
+_surrogate_engine = None
+_surrogate_engine_lock = threading.Lock()
+
+def get_surrogate_engine():
+    global _surrogate_engine
+    with _surrogate_engine_lock:
+        if _surrogate_engine is None:
+            _surrogate_engine = SurrogateEngine()
+        return _surrogate_engine
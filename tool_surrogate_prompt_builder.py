@@ -1,6 +1,13 @@
 import json
+import re
+from knowledge_index import KnowledgeBaseIndex, KB_TOP_K, KB_MAX_TOKENS, query_weights, tool_query_weights
 
-MAX_HISTORY = 10000
+MAX_HISTORY = 10000                          # Characters of conversation history in a surrogate prompt
+MAX_HISTORY_MESSAGE = MAX_HISTORY // 4       # Longer messages are cut to this many characters
+HISTORY_RECENT_MESSAGES = 6                  # The most recent messages are always included (if they fit)
+
+_WORD = re.compile(r'[^\W_]{3,}')
+_ARGS_SLOT = "\x00ARGS\x00"  # Stands in for the argument values while a template is compiled
 
 # Helper function for safe JSON serialization
 def safe_stringify(data, indent=2):
@@ -55,8 +62,15 @@ You are providing this information to:
 </CALLING_AGENT>
 """
 
-def knowledge_base(agent_config):
-    kb = json.dumps(agent_config.get("knowledgeBase", "none"))
+def knowledge_base(agent_config, passages=None):
+    """
+    The knowledge base section: the passages retrieved for this tool call (see
+    knowledge_index.py), or the whole knowledge base if passages is None.
+    """
+    if passages is None:
+        kb = json.dumps(agent_config.get("knowledgeBase", "none"))
+    else:
+        kb = "\n".join(passages) if passages else "none"
     return f"""
 <KNOWLEDGE_BASE>
 Information available to you for this task:
@@ -76,43 +90,197 @@ def general_guidance():
 </GENERAL_GUIDANCE>
 """
 
-def conversation_history(history):
+class RenderedHistory:
     """
-    Formats the conversation history into a readable string for the prompt.
+    Conversation history of one agent session, rendered once per message, with
+    an index of the words of each message. The saved history only grows at the
+    end, so update() renders just the messages added since the last tool call.
     """
-    history_str = ""
-    if history:
-        for message in history:
-            role = message.role
+    def __init__(self):
+        self.lines = []
+        self.words = {}  # lowercase word -> indexes of the messages that contain it
+
+    def update(self, history):
+        if len(history) < len(self.lines):
+            # Not the history this was built from: start over
+            self.lines = []
+            self.words = {}
+        for message in (history or [])[len(self.lines):]:
             content = ""
             if message.content and isinstance(message.content, list) and 'text' in message.content[0]:
                 content = message.content[0]['text']
-            history_str += f"{role}: {content}\n"
+            index = len(self.lines)
+            line = f"{message.role}: {content}"
+            if len(line) > MAX_HISTORY_MESSAGE:
+                line = line[:MAX_HISTORY_MESSAGE] + " [...]"
+            self.lines.append(line)
+            for word in set(_WORD.findall(content.lower())):
+                self.words.setdefault(word, []).append(index)
+
+    def select(self, terms, max_chars=MAX_HISTORY, recent=HISTORY_RECENT_MESSAGES):
+        """
+        Indexes (ascending) of the messages to show: the most recent ones, then
+        the older ones that mention the given terms, best matches first (rare
+        terms count more), until max_chars is used up.
+        """
+        chosen = []
+        used = 0
+        first_recent = max(0, len(self.lines) - recent)
+        for index in range(len(self.lines) - 1, first_recent - 1, -1):
+            if used + len(self.lines[index]) > max_chars:
+                break
+            chosen.append(index)
+            used += len(self.lines[index]) + 1
+
+        scores = {}
+        for term in terms:
+            postings = self.words.get(term, ())
+            for index in postings:
+                if index < first_recent:
+                    scores[index] = scores.get(index, 0.0) + 1.0 / len(postings)
+        for index in sorted(scores, key=lambda index: (scores[index], index), reverse=True):
+            if used + len(self.lines[index]) > max_chars:
+                continue
+            chosen.append(index)
+            used += len(self.lines[index]) + 1
+        return sorted(chosen)
+
+
+def _argument_terms(tool_name, args):
+    """Lowercase words of the tool name and of the argument values."""
+    values = []
+    def collect(value):
+        if isinstance(value, dict):
+            for item in value.values():
+                collect(item)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                collect(item)
+        elif value is not None:
+            values.append(str(value))
+    collect({key: value for key, value in (args or {}).items() if key != 'tool_name'})
+    return set(_WORD.findall(f"{tool_name} {' '.join(values)}".lower()))
+
+
+def conversation_history(history, tool_name=None, args=None, rendered=None):
+    """
+    Formats a bounded slice of the conversation history for the prompt: the
+    most recent messages plus earlier ones that mention the tool or its
+    arguments, at most MAX_HISTORY characters. Omitted stretches show as "...".
+    Pass the session's RenderedHistory as rendered so messages are only
+    rendered once.
+    """
+    if rendered is None:
+        rendered = RenderedHistory()
+    rendered.update(history)
+    parts = []
+    previous = -1
+    for index in rendered.select(_argument_terms(tool_name, args)):
+        if index > previous + 1:
+            parts.append("...")
+        parts.append(rendered.lines[index])
+        previous = index
+    if parts and previous < len(rendered.lines) - 1:
+        parts.append("...")
+    history_str = "\n".join(parts)
     return f"""
 <CONVERSATION_HISTORY>
-{history_str.strip()}
+{history_str}
 </CONVERSATION_HISTORY>
 """
 
 
-def build_tool_surrogate_prompt(scenario, agent_config, tool_name, tool_config, args, chat_history):
+class SurrogatePromptTemplate:
+    """
+    Surrogate prompt of one tool of one agent with every section that does not
+    change during a run (task, scenario, agent profile, guidance) rendered
+    once, at scenario load. render() only fills in the argument values, the
+    conversation history and the knowledge base passages relevant to the call.
+    """
+    __slots__ = ("tool_name", "_before_args", "_before_history", "_profile", "_guidance",
+                 "_kb_index", "_kb_query", "_kb_top_k", "_kb_max_tokens")
+
+    def __init__(self, scenario, agent_config, tool_name, tool_config, kb_index=None):
+        task_before_args, task_after_args = task(tool_name, tool_config, _ARGS_SLOT).split(_ARGS_SLOT)
+        self.tool_name = tool_name
+        self._before_args = task_before_args
+        self._before_history = task_after_args + scenario_header(scenario)
+        self._profile = agent_profile(agent_config)
+        self._guidance = general_guidance()
+        self._kb_index = kb_index if kb_index is not None else KnowledgeBaseIndex(agent_config.get("knowledgeBase", {}))
+        self._kb_query = tool_query_weights(tool_name, tool_config)
+        self._kb_top_k = agent_config.get('knowledgeBaseTopK', KB_TOP_K)
+        self._kb_max_tokens = agent_config.get('knowledgeBaseMaxTokens', KB_MAX_TOKENS)
+
+    def knowledge_passages(self, args):
+        return self._kb_index.search(query_weights(self._kb_query, args), self._kb_top_k, self._kb_max_tokens)
+
+    def render(self, args, chat_history, rendered_history=None):
+        return "".join((
+            self._before_args,
+            str(args),
+            self._before_history,
+            conversation_history(chat_history, self.tool_name, args, rendered_history),
+            self._profile,
+            knowledge_base(None, self.knowledge_passages(args)),
+            self._guidance,
+        ))
+
+
+def compile_surrogate_prompts(scenario, agent_config):
+    """SurrogatePromptTemplate of every tool of the agent, by tool name, sharing one knowledge base index."""
+    kb_index = KnowledgeBaseIndex(agent_config.get("knowledgeBase", {}))
+    return {
+        tool_config['toolName']: SurrogatePromptTemplate(scenario, agent_config, tool_config['toolName'], tool_config, kb_index)
+        for tool_config in agent_config.get('tools', [])
+        if tool_config.get('toolName')
+    }
+
+
+def build_tool_surrogate_prompt(scenario, agent_config, tool_name, tool_config, args, chat_history, rendered_history=None):
     """
     Assembles the complete tool surrogate prompt by calling all the component functions.
-    """ 
-    # print("1 ", task(tool_name, tool_config, args))
-    # print("2 ", scenario_header(scenario))
-    # print("3 ", conversation_history(chat_history))
-    # print("4 ", agent_profile(agent_config))
-    # print("5 ", knowledge_base(agent_config))
-    # print("6 ", general_guidance())
-
-    prompt_parts = [
-        task(tool_name, tool_config, args),
-        scenario_header(scenario),
-        conversation_history(chat_history),
-        agent_profile(agent_config),
-        knowledge_base(agent_config),
-        general_guidance(),
+    rendered_history is the session's RenderedHistory, reused across tool calls.
+    Agents use the templates compiled at scenario load instead (compile_surrogate_prompts).
+    """
+    return SurrogatePromptTemplate(scenario, agent_config, tool_name, tool_config).render(args, chat_history, rendered_history)
+
+
+if __name__ == "__main__":
+    # Microbenchmark of the per-call prompt build cost:
+    #   python tool_surrogate_prompt_builder.py [scenario.json] [--calls N] [--history N]
+    import argparse
+    import timeit
+    from types import SimpleNamespace
+    parser = argparse.ArgumentParser(description="Compare building surrogate prompts from scratch with compiled templates")
+    parser.add_argument("scenario", nargs="?", default="processed_scenarios/knee_mri.json")
+    parser.add_argument("--calls", type=int, default=2000, help="prompt builds per measurement")
+    parser.add_argument("--history", type=int, default=40, help="messages of conversation history")
+    bench_args = parser.parse_args()
+
+    with open(bench_args.scenario, 'r', encoding="utf-8") as f:
+        scenario = json.load(f)
+    history = [
+        SimpleNamespace(role="user" if i % 2 else "assistant",
+                        content=[{"text": f"TURN {i}: Agent a said: " + "details of the request and the coverage policy " * 6}])
+        for i in range(bench_args.history)
     ]
-    
-    return "".join(prompt_parts)
+    print(f"{bench_args.scenario}: {bench_args.calls} builds per tool, {bench_args.history} history messages")
+    print(f"{'agent':<28} {'tool':<36} {'from scratch':>13} {'compiled':>10} {'speed-up':>9}")
+    for agent_config in scenario.get('agents', []):
+        compile_started = timeit.default_timer()
+        templates = compile_surrogate_prompts(scenario, agent_config)
+        compile_time = timeit.default_timer() - compile_started
+        rendered = RenderedHistory()
+        for tool_config in agent_config.get('tools', []):
+            tool_name = tool_config.get('toolName')
+            if not tool_name:
+                continue
+            args = {key: "example value" for key in tool_config.get('inputSchema', {}).get('properties', {})}
+            scratch = timeit.timeit(lambda: build_tool_surrogate_prompt(
+                scenario, agent_config, tool_name, tool_config, args, history, rendered), number=bench_args.calls)
+            compiled = timeit.timeit(lambda: templates[tool_name].render(args, history, rendered), number=bench_args.calls)
+            print(f"{agent_config.get('agentId', '?'):<28} {tool_name:<36} "
+                  f"{scratch / bench_args.calls * 1e6:>11.1f}us {compiled / bench_args.calls * 1e6:>8.1f}us "
+                  f"{scratch / compiled:>8.1f}x")
+        print(f"{'':<28} (compiling the {len(templates)} templates took {compile_time * 1e3:.2f}ms)")
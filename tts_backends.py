@@ -0,0 +1,147 @@
+"""
+Pluggable text-to-speech backends.
+
+A backend is a TTS service class that implements the TTSBackend interface.
+Backends are registered by name and imported only when selected, so picking
+one never loads the client libraries of the others:
+
+    google  Google Cloud TTS (needs credentials and network)
+    gtts    gTTS, with pitch shifting for the second speaker (needs network)
+    local   Offline synthetic tones with realistic latency, for benchmarks and
+            load tests of the audio pipeline on machines without network
+    none    No audio
+
+The backend is chosen at runtime: the TTS_BACKEND environment variable or a
+--tts <name> command line option overrides the default of the runner.
+
+The selected backend is only imported and created the first time audio is
+needed (get_tts_service), so the CLI and server start without loading gRPC,
+gTTS or starting worker threads, and the "none" backend never imports
+anything audio related.
+"""
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+
+
+class TTSBackend(ABC):
+    """
+    Interface of a TTS service. Clips are identified by URL under /static/audio.
+    A backend that does not implement the abstract methods fails when it is
+    created, not partway through synthesis.
+
+    generate_audio_async(text, speaker_id, timeout=None)
+        Queue generation and return a concurrent.futures.Future that resolves
+        to the clip URL (None on failure). May block while the queue is full.
+    get_audio_url(text, speaker_id)
+        Generate synchronously (or find the cached clip) and return its URL.
+    stats()
+        Dict with the backend's pool and cache statistics.
+    """
+    name = None
+
+    @abstractmethod
+    def generate_audio_async(self, text, speaker_id, timeout=None):
+        ...
+
+    @abstractmethod
+    def get_audio_url(self, text, speaker_id):
+        ...
+
+    def stats(self):
+        return {}
+
+
+def _create_google():
+    from google_cloud_tts_service import GoogleCloudTTSService
+    return GoogleCloudTTSService()
+
+def _create_gtts():
+    from tts_service import TTSService
+    return TTSService()
+
+def _create_local():
+    from local_tts_service import LocalToneTTSService
+    return LocalToneTTSService()
+
+
+TTS_BACKENDS = {
+    "google": _create_google,
+    "gtts": _create_gtts,
+    "local": _create_local,
+    "none": lambda: None,
+}
+
+
+def create_tts_service(name):
+    """Instantiate the named backend (None for "none")."""
+    if name not in TTS_BACKENDS:
+        raise ValueError(f"Unknown TTS backend '{name}'. Choose one of: {', '.join(TTS_BACKENDS)}")
+    return TTS_BACKENDS[name]()
+
+
+def tts_backend_from_args(argv, default):
+    """
+    The backend to use: --tts <name> (or --tts=<name>) in argv, else the
+    TTS_BACKEND environment variable, else default. The option is removed
+    from argv so the rest of the command line parses as before.
+    """
+    name = os.getenv("TTS_BACKEND") or default
+    for i, arg in enumerate(argv):
+        if arg == "--tts" and i + 1 < len(argv):
+            name = argv[i + 1]
+            del argv[i:i + 2]
+            break
+        if arg.startswith("--tts="):
+            name = arg.split("=", 1)[1]
+            del argv[i]
+            break
+    return name
+
+
+# Backend selected for the process, created lazily by get_tts_service()
+_tts_backend_name = "none"
+_tts_service = None
+_tts_service_created = False
+_tts_service_lock = threading.Lock()
+
+def configure_tts_backend(name):
+    """Select the backend for get_tts_service(). Nothing is imported or created yet."""
+    global _tts_backend_name, _tts_service, _tts_service_created
+    if name not in TTS_BACKENDS:
+        raise ValueError(f"Unknown TTS backend '{name}'. Choose one of: {', '.join(TTS_BACKENDS)}")
+    with _tts_service_lock:
+        _tts_backend_name = name
+        _tts_service = None
+        _tts_service_created = False
+
+def tts_enabled():
+    return _tts_backend_name != "none"
+
+def get_tts_service():
+    """The selected backend's service, created on first use (None for "none")."""
+    global _tts_service, _tts_service_created
+    with _tts_service_lock:
+        if not _tts_service_created:
+            started = time.perf_counter()
+            try:
+                _tts_service = create_tts_service(_tts_backend_name)
+            except Exception as e:
+                print(f"Could not initialise text-to-speech backend '{_tts_backend_name}': {e}. Continuing without audio.")
+                _tts_service = None
+            _tts_service_created = True
+            if _tts_service is not None:
+                print(f"Text-to-speech backend '{_tts_backend_name}' initialised in {time.perf_counter() - started:.2f}s")
+        return _tts_service
+
+def warm_up_tts_service():
+    """Create the backend in a background thread, so the first message does not wait for it."""
+    if tts_enabled() and not _tts_service_created:
+        threading.Thread(target=get_tts_service, name="tts-warm-up", daemon=True).start()
+
+def tts_service_stats():
+    """Stats of the backend, or None if it has not been created."""
+    with _tts_service_lock:
+        service = _tts_service
+    return service.stats() if service is not None else None
@@ -0,0 +1,108 @@
+"""
+Sentence-chunked audio for long messages.
+
+Instead of synthesising a whole message as one clip (nothing can play until
+all of it exists, and very long messages can exceed the TTS request size
+limit), the text is split into sentence chunks that are queued on the TTS
+service's worker pool together, so they are synthesised concurrently. The
+clips form an ordered playlist that is published as it grows: the first
+sentence can play while the rest is still being generated.
+
+The first chunk is a single sentence so playback can start as early as
+possible; later sentences are grouped up to TTS_CHUNK_MAX_CHARS to keep the
+number of requests down.
+"""
+import re
+import threading
+
+TTS_CHUNK_MAX_CHARS = 400  # Well below the 5000-byte limit of a Google Cloud TTS request
+
+_SENTENCE_END = re.compile(r'(?<=[.!?:;])\s+|\n+')
+
+
+def _split_long_sentence(sentence, max_chars):
+    """Split a sentence that is longer than max_chars at word boundaries."""
+    parts = []
+    current = ""
+    for word in sentence.split():
+        if current and len(current) + 1 + len(word) > max_chars:
+            parts.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_into_chunks(text, max_chars=TTS_CHUNK_MAX_CHARS):
+    """Split text into sentence chunks: the first sentence alone, then groups of up to max_chars."""
+    sentences = []
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(sentence) > max_chars:
+            sentences.extend(_split_long_sentence(sentence, max_chars))
+        else:
+            sentences.append(sentence)
+    if not sentences:
+        return []
+
+    chunks = [sentences[0]]
+    current = ""
+    for sentence in sentences[1:]:
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def queue_playlist(tts_service, text, speaker_id, on_update, max_chars=TTS_CHUNK_MAX_CHARS):
+    """
+    Queues one clip per chunk of text on the TTS service and reports the
+    playlist as it becomes playable.
+
+    on_update(urls, complete) is called from the worker threads with the clips
+    ready so far, in order and without gaps (a clip that finishes before an
+    earlier one is held back until the earlier one is ready). complete is True
+    on the last call. A chunk that fails is left out of the playlist.
+
+    Returns the list of chunk Futures.
+    """
+    chunks = split_into_chunks(text, max_chars)
+    if not chunks:
+        on_update([], True)
+        return []
+
+    results = [None] * len(chunks)
+    done = [False] * len(chunks)
+    lock = threading.Lock()
+    state = {"published": 0}  # Chunks, in order, already included in an update
+
+    def chunk_done(index, future):
+        with lock:
+            done[index] = True
+            if not future.cancelled() and future.exception() is None:
+                results[index] = future.result()
+            published = state["published"]
+            while published < len(chunks) and done[published]:
+                published += 1
+            if published == state["published"]:
+                return
+            state["published"] = published
+            urls = [url for url in results[:published] if url]
+            complete = published == len(chunks)
+            # Report under the lock so updates are delivered in order
+            on_update(urls, complete)
+
+    futures = []
+    for index, chunk in enumerate(chunks):
+        future = tts_service.generate_audio_async(chunk, speaker_id)
+        future.add_done_callback(lambda f, index=index: chunk_done(index, f))
+        futures.append(future)
+    return futures
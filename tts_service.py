@@ -2,33 +2,54 @@
 Text-to-Speech service for generating audio from conversation messages.
 Uses gTTS for simple TTS generation with different voices for each speaker.
 """
+import io
 import os
-import hashlib
 import subprocess
 from gtts import gTTS
 from pathlib import Path
-import threading
-import queue
+from concurrent.futures import Future
+from audio_cache import get_audio_cache, clip_name
+from tts_backends import TTSBackend
+from tts_worker_pool import TTSWorkerPool, TTS_PROCESS_WORKERS, TTS_MAX_QUEUE
 
-class TTSService:
-    def __init__(self, audio_dir="static/audio"):
-        self.audio_dir = Path(audio_dir)
-        self.audio_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Queue for async audio generation
-        self.generation_queue = queue.Queue()
-        self.worker_thread = threading.Thread(target=self._process_queue, daemon=True)
-        self.worker_thread.start()
-        
-        # Voice configurations for different speakers   see https://gtts.readthedocs.io/en/latest/module.html
-        # We'll use different languages/accents to differentiate voices
-        self.voice_configs = {
-            "speaker1": {"lang": "en", "tld": "ie", "slow": False}, 
-            "speaker2": {"lang": "en", "tld": "co.uk", "slow": False}
-        }
-    
+# Pitch shifting runs in-process when numpy and soundfile (libsndfile >= 1.1,
+# for MP3 support) are installed; otherwise it falls back to ffmpeg
+try:
+    import numpy as np
+    import soundfile as sf
+    from audio_effects import shift_pitch_and_tempo
+    IN_PROCESS_AUDIO = 'MP3' in sf.available_formats()
+except (ImportError, OSError):
+    IN_PROCESS_AUDIO = False
+
+# Voice configurations for different speakers   see https://gtts.readthedocs.io/en/latest/module.html
+# We'll use different languages/accents to differentiate voices.
+# pitch_factor/tempo_factor (optional) are applied after synthesis:
+# a lower pitch sounds more masculine, a higher tempo is faster.
+VOICE_CONFIGS = {
+    "speaker1": {"lang": "en", "tld": "ie", "slow": False},
+    "speaker2": {"lang": "en", "tld": "co.uk", "slow": False, "pitch_factor": 0.75, "tempo_factor": 1.5}
+}
+
+
+# gTTS always produces the same sample rate, so it is only probed once per process
+_detected_sample_rate = None
+
+
+class _AudioProcessor:
+    """
+    gTTS synthesis and pitch shifting. These methods never touch the service's
+    threads or queues, so they can run in the worker pool's processes.
+    """
     def _get_sample_rate(self, filepath):
-        """Detect the sample rate of an audio file using ffprobe."""
+        """Detect the sample rate of an audio file using ffprobe (once; the result is cached)."""
+        global _detected_sample_rate
+        if _detected_sample_rate is None:
+            _detected_sample_rate = self._probe_sample_rate(filepath)
+            print(f"Detected sample rate: {_detected_sample_rate} Hz")
+        return _detected_sample_rate
+
+    def _probe_sample_rate(self, filepath):
         try:
             cmd = [
                 'ffprobe',
@@ -53,7 +74,8 @@ class TTSService:
     
     def _apply_pitch_shift(self, filepath, pitch_factor=0.80, tempo_factor=1.15):
         """
-        Apply pitch shifting and tempo adjustment to an audio file using ffmpeg.
+        Apply pitch shifting and tempo adjustment to an audio file using ffmpeg
+        (fallback when the in-process pipeline is unavailable).
         pitch_factor < 1.0 lowers the pitch (more masculine)
         pitch_factor > 1.0 raises the pitch (more feminine)
         tempo_factor > 1.0 speeds up playback, < 1.0 slows it down
@@ -63,7 +85,6 @@ class TTSService:
             
             # Detect the actual sample rate of the input file
             sample_rate = self._get_sample_rate(filepath)
-            print(f"Detected sample rate: {sample_rate} Hz")
             
             # Use ffmpeg to shift pitch and adjust tempo
             # asetrate changes the sample rate (lower = deeper pitch)
@@ -100,78 +121,156 @@ class TTSService:
             print(f"Error applying pitch shift to {filepath.name}: {e}")
             return False
     
+    def _write_pitch_shifted(self, filepath, mp3_bytes, pitch_factor, tempo_factor):
+        """
+        Decode the MP3 in memory, shift pitch and tempo with numpy and encode
+        once, straight to filepath. Returns False if in-process processing failed.
+        """
+        temp_output = filepath.with_suffix('.pitched.mp3')
+        try:
+            samples, sample_rate = sf.read(io.BytesIO(mp3_bytes), dtype='float64')
+            shifted = shift_pitch_and_tempo(samples, pitch_factor, tempo_factor)
+            sf.write(str(temp_output), shifted.astype(np.float32), sample_rate, format='MP3')
+            temp_output.replace(filepath)
+            print(f"Applied pitch shift (factor={pitch_factor}) to {filepath.name}")
+            return True
+        except Exception as e:
+            print(f"In-process pitch shift failed for {filepath.name}, falling back to ffmpeg: {e}")
+            if temp_output.exists():
+                temp_output.unlink()
+            return False
+
+    def _synthesize(self, filepath, text, voice_config):
+        """Generate speech for text into filepath. Returns True on success."""
+        # Clean text for better TTS
+        clean_text = text.strip()
+        if not clean_text:
+            return False
+        
+        # Generate speech
+        tts = gTTS(
+            text=clean_text,
+            lang=voice_config["lang"],
+            tld=voice_config["tld"],
+            slow=voice_config["slow"]
+        )
+        
+        # Voices with a pitch shift are processed in memory and written once
+        if "pitch_factor" in voice_config and IN_PROCESS_AUDIO:
+            buffer = io.BytesIO()
+            tts.write_to_fp(buffer)
+            mp3_bytes = buffer.getvalue()
+            if not mp3_bytes:
+                print(f"Error: Generated empty audio file for: {text[:50]}...")
+                return False
+            if self._write_pitch_shifted(filepath, mp3_bytes, voice_config["pitch_factor"],
+                                         voice_config.get("tempo_factor", 1.0)):
+                return True
+            # Fallback: write the unprocessed clip and shift it with ffmpeg
+            temp_filepath = filepath.with_suffix('.tmp.mp3')
+            temp_filepath.write_bytes(mp3_bytes)
+        else:
+            # Save to file
+            temp_filepath = filepath.with_suffix('.tmp.mp3')
+            tts.save(str(temp_filepath))
+        
+        # Verify file was created and has content
+        if temp_filepath.exists() and temp_filepath.stat().st_size > 0:
+            temp_filepath.replace(filepath)
+            #print(f"Generated audio: {filepath.name} ({filepath.stat().st_size} bytes)")
+            
+            # Apply pitch shift to voices that have one (e.g. speaker2: more masculine and faster)
+            if "pitch_factor" in voice_config:
+                self._apply_pitch_shift(filepath, pitch_factor=voice_config["pitch_factor"],
+                                        tempo_factor=voice_config.get("tempo_factor", 1.0))
+            return True
+        else:
+            print(f"Error: Generated empty audio file for: {text[:50]}...")
+            if temp_filepath.exists():
+                temp_filepath.unlink()
+            return False
+
+
+def _generate_audio_task(audio_dir, filename, text, voice_config):
+    """Worker pool task: generate one clip and return its URL (None on failure)."""
+    filepath = Path(audio_dir) / filename
+    if filepath.exists() and filepath.stat().st_size > 0:
+        return f"/static/audio/{filename}"
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        if _AudioProcessor()._synthesize(filepath, text, voice_config):
+            return f"/static/audio/{filename}"
+    except Exception as e:
+        print(f"Error generating audio for '{text[:50]}...': {e}")
+    return None
+
+
+class TTSService(_AudioProcessor, TTSBackend):
+    name = "gtts"
+
+    def __init__(self, audio_dir="static/audio", workers=TTS_PROCESS_WORKERS, max_queue=TTS_MAX_QUEUE):
+        self.audio_dir = Path(audio_dir)
+        self.audio_dir.mkdir(parents=True, exist_ok=True)
+        self.cache = get_audio_cache(audio_dir)
+        
+        # Worker pool for async audio generation; gTTS plus ffmpeg pitch
+        # shifting is CPU heavy, so clips are generated in separate processes
+        self.pool = TTSWorkerPool(_generate_audio_task, workers=workers, max_queue=max_queue,
+                                  use_processes=True, name="gtts")
+        
+        self.voice_configs = VOICE_CONFIGS
+    
     def _get_audio_filename(self, text, speaker_id):
-        """Generate a unique filename based on text and speaker."""
-        text_hash = hashlib.md5(f"{speaker_id}:{text}".encode()).hexdigest()
-        return f"{text_hash}.mp3"
+        """Cache name of the clip: depends on the text and the speaker's full voice config."""
+        voice_config = self.voice_configs.get(speaker_id, self.voice_configs["speaker1"])
+        return clip_name("gtts", voice_config, text.strip())
     
     def _generate_audio_file(self, text, speaker_id):
         """Generate audio file for the given text and speaker."""
         filename = self._get_audio_filename(text, speaker_id)
-        filepath = self.audio_dir / filename
+        filepath = self.cache.prepare_path(filename)
         
-        # Skip if already exists and is non-empty
-        if filepath.exists() and filepath.stat().st_size > 0:
+        # Skip if already cached
+        if self.cache.lookup(filename):
             return filename
         
         try:
             # Get voice config for speaker
             voice_config = self.voice_configs.get(speaker_id, self.voice_configs["speaker1"])
-            
-            # Clean text for better TTS
-            clean_text = text.strip()
-            if not clean_text:
-                return None
-            
-            # Generate speech
-            tts = gTTS(
-                text=clean_text,
-                lang=voice_config["lang"],
-                tld=voice_config["tld"],
-                slow=voice_config["slow"]
-            )
-            
-            # Save to file
-            temp_filepath = filepath.with_suffix('.tmp.mp3')
-            tts.save(str(temp_filepath))
-            
-            # Verify file was created and has content
-            if temp_filepath.exists() and temp_filepath.stat().st_size > 0:
-                temp_filepath.rename(filepath)
-                #print(f"Generated audio: {filename} ({filepath.stat().st_size} bytes)")
-                
-                # Apply pitch shift for speaker2 to make voice more masculine and faster
-                if speaker_id == "speaker2":
-                    self._apply_pitch_shift(filepath, pitch_factor=0.75, tempo_factor=1.5)
-                
+            if self._synthesize(filepath, text, voice_config):
+                self.cache.add(filename, voice_config)
                 return filename
-            else:
-                print(f"Error: Generated empty audio file for: {text[:50]}...")
-                if temp_filepath.exists():
-                    temp_filepath.unlink()
-                return None
+            return None
                 
         except Exception as e:
             print(f"Error generating audio for '{text[:50]}...': {e}")
             return None
     
-    def _process_queue(self):
-        """Background worker to process audio generation queue."""
-        while True:
-            try:
-                task = self.generation_queue.get()
-                if task is None:
-                    break
-                
-                text, speaker_id = task
-                self._generate_audio_file(text, speaker_id)
-                self.generation_queue.task_done()
-            except Exception as e:
-                print(f"Error in TTS worker: {e}")
+    def generate_audio_async(self, text, speaker_id, timeout=None):
+        """
+        Queue audio generation for async processing.
+        Returns a concurrent.futures.Future that resolves to the audio URL (None on failure).
+        Cached clips resolve immediately; otherwise this blocks while the generation queue is full.
+        """
+        voice_config = self.voice_configs.get(speaker_id, self.voice_configs["speaker1"])
+        filename = self._get_audio_filename(text, speaker_id)
+        if self.cache.lookup(filename):
+            future = Future()
+            future.set_result(f"/static/audio/{filename}")
+            return future
+        
+        future = self.pool.submit(str(self.audio_dir), filename, text, voice_config, timeout=timeout)
+        
+        def record_clip(done):
+            # The clip was written by a worker process; the cache index lives here
+            if not done.cancelled() and done.exception() is None and done.result():
+                self.cache.add(filename, voice_config)
+        
+        future.add_done_callback(record_clip)
+        return future
     
-    def generate_audio_async(self, text, speaker_id):
-        """Queue audio generation for async processing."""
-        self.generation_queue.put((text, speaker_id))
+    def stats(self):
+        return {"pool": self.pool.stats(), "cache": self.cache.stats()}
     
     def generate_audio(self, text, speaker_id):
         """Generate audio synchronously and return filename."""
@@ -179,15 +278,8 @@ class TTSService:
     
     def get_audio_url(self, text, speaker_id):
         """Get the URL for the audio file (generate if needed)."""
-        filename = self._get_audio_filename(text, speaker_id)
-        filepath = self.audio_dir / filename
-        
-        if not filepath.exists():
-            filename = self._generate_audio_file(text, speaker_id)
+        filename = self._generate_audio_file(text, speaker_id)
         
         if filename:
             return f"/static/audio/{filename}"
         return None
-
-# Global TTS service instance
-tts_service = TTSService()
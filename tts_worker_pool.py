@@ -0,0 +1,129 @@
+"""
+Worker pool for text-to-speech generation.
+
+Audio generation used to go through a single worker thread per TTS service, so
+a burst of long messages was synthesised one clip at a time. The pool runs
+several workers fed from one bounded queue:
+
+- Thread workers suit the network-bound Google Cloud client.
+- With use_processes=True each worker hands its task to a process pool, for
+  the gTTS path whose pitch shifting is CPU/ffmpeg bound. The generate
+  function must then be a picklable module-level function.
+
+submit() blocks while the queue is full, which pushes back on the producer
+instead of letting the backlog grow without limit. Every task gets its own
+Future, and the pool keeps queue depth and latency metrics (stats()).
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+TTS_WORKERS = 4            # Clips generated at the same time per TTS service
+TTS_MAX_QUEUE = 64         # Tasks waiting for a worker before submit() blocks
+TTS_PROCESS_WORKERS = min(4, os.cpu_count() or 1)
+
+
+class TTSWorkerPool:
+    """
+    Args:
+        generate: function called as generate(*args) for each task; its return
+            value becomes the result of the task's Future.
+        workers: number of worker threads (and processes, if use_processes).
+        max_queue: bound of the task queue.
+        use_processes: run generate in a process pool instead of the worker threads.
+        name: prefix of the worker thread names.
+    """
+
+    def __init__(self, generate, workers=TTS_WORKERS, max_queue=TTS_MAX_QUEUE, use_processes=False, name="tts"):
+        self.generate = generate
+        self.workers = workers
+        self.tasks = queue.Queue(maxsize=max_queue)
+        self.executor = ProcessPoolExecutor(max_workers=workers) if use_processes else None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+        self.total_wait_time = 0.0      # Seconds tasks spent in the queue
+        self.total_generate_time = 0.0  # Seconds spent generating
+        self.max_generate_time = 0.0
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, name=f"{name}-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, *args, timeout=None):
+        """
+        Queue a task and return its Future. Blocks while the queue is full
+        (raises queue.Full if timeout passes first).
+        """
+        future = Future()
+        self.tasks.put((args, future, time.perf_counter()), timeout=timeout)
+        with self._lock:
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.tasks.qsize())
+        return future
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                self.tasks.task_done()
+                break
+            args, future, enqueued_at = task
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                started_at = time.perf_counter()
+                try:
+                    if self.executor is not None:
+                        result = self.executor.submit(self.generate, *args).result()
+                    else:
+                        result = self.generate(*args)
+                except Exception as e:
+                    print(f"Error in TTS worker: {e}")
+                    with self._lock:
+                        self.failed += 1
+                    future.set_exception(e)
+                    continue
+                generate_time = time.perf_counter() - started_at
+                with self._lock:
+                    self.completed += 1
+                    self.total_wait_time += started_at - enqueued_at
+                    self.total_generate_time += generate_time
+                    self.max_generate_time = max(self.max_generate_time, generate_time)
+                future.set_result(result)
+            finally:
+                self.tasks.task_done()
+
+    def join(self):
+        """Wait until every queued task has been processed."""
+        self.tasks.join()
+
+    def shutdown(self):
+        for _ in self._threads:
+            self.tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def stats(self):
+        with self._lock:
+            finished = self.completed
+            return {
+                "workers": self.workers,
+                "uses_processes": self.executor is not None,
+                "queue_depth": self.tasks.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "queue_capacity": self.tasks.maxsize,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait_seconds": round(self.total_wait_time / finished, 3) if finished else 0.0,
+                "avg_generate_seconds": round(self.total_generate_time / finished, 3) if finished else 0.0,
+                "max_generate_seconds": round(self.max_generate_time, 3),
+            }